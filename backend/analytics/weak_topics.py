@@ -1,6 +1,7 @@
 
 from collections import defaultdict
 from datetime import datetime
+from rag.keywords import SubstringCounter
 from rag.validation import normalize_text
 
 TOPIC_MAP = {
@@ -29,18 +30,17 @@ TOPIC_MAP = {
     }
 }
 
+# every topic across subjects, a later subject's topic of the same name winning
+_TOPIC_COUNTER = SubstringCounter(
+    {topic: keywords for subject_topics in TOPIC_MAP.values() for topic, keywords in subject_topics.items()}
+)
+
 def extract_topic_from_text(text):
     if not text:
         return "General"
-    text_lower = text.lower()
-    all_topics = {}
-    for subject_topics in TOPIC_MAP.values():
-        all_topics.update(subject_topics)
-
     best_topic = "General"
     max_matches = 0
-    for topic, keywords in all_topics.items():
-        matches = sum(1 for keyword in keywords if keyword in text_lower)
+    for topic, matches in _TOPIC_COUNTER.counts(text.lower()).items():
         if matches > max_matches:
             max_matches = matches
             best_topic = topic.title()
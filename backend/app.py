@@ -8,9 +8,11 @@ from config import (
     DATABASE_URL,
     LOG_DIR,
     SECRET_KEY,
+    WARMUP_ON_STARTUP,
 )
 
 from database.db import db
+from database.migrations import ensure_schema
 
 print("IMPORTING analytics_routes")
 from routes.analytics_routes import analytics_bp
@@ -18,6 +20,8 @@ from routes.analytics_routes import analytics_bp
 print("IMPORTING question_routes")
 from routes.question_routes import question_bp
 
+from rag.warmup import start_warmup
+
 print("ROUTES IMPORTED")
 
 def create_app():
@@ -71,8 +75,13 @@ def create_app():
 
     with app.app_context():
         db.create_all()
+        ensure_schema()
+
+    if WARMUP_ON_STARTUP:
+        print("STEP 6: Warming up index and embedder in the background")
+        start_warmup()
 
-    print("STEP 6: Startup complete")
+    print("STEP 7: Startup complete")
 
     return app
 
@@ -0,0 +1,31 @@
+import argparse
+
+from app import create_app
+from database.db import db
+from ingestion.backfill import (
+    backfill_question_classified_topics,
+    backfill_question_clusters,
+    backfill_question_keys,
+    backfill_question_topics,
+)
+from rag.embeddings import get_faiss_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill computed question columns on existing rows")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--recompute", action="store_true", help="recompute every row, not only missing values")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        updated = backfill_question_keys(db.session, batch_size=args.batch_size, recompute=args.recompute)
+        print(f"is_valid / text_hash: {updated} questions updated")
+        updated = backfill_question_classified_topics(
+            db.session, get_faiss_store(), batch_size=args.batch_size, recompute=args.recompute
+        )
+        print(f"topic: {updated} questions classified")
+        updated = backfill_question_topics(db.session, batch_size=args.batch_size, recompute=args.recompute)
+        print(f"topic_id: {updated} questions updated")
+        signed, clustered = backfill_question_clusters(db.session, batch_size=args.batch_size, recompute=args.recompute)
+        print(f"near-duplicate clusters: {signed} signatures computed, {clustered} questions clustered")
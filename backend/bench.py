@@ -0,0 +1,215 @@
+"""
+Microbenchmarks for hot paths that have a reference implementation to
+compare against. Each benchmark also checks that both produce the same
+output, and the run exits non-zero when they differ.
+
+    python bench.py fallback-embedder --texts 20000
+    python bench.py encoders --texts 2000 --batch-sizes 16,32,64
+    python bench.py keywords --texts 20000
+    python bench.py topic-scores --texts 20000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+WORDS = (
+    "force velocity acceleration momentum energy work power torque friction gravity "
+    "current voltage resistance capacitor magnetic field wave lens refraction photon "
+    "mole acid base salt equilibrium enthalpy entropy oxidation reduction electrode "
+    "alkane alkene benzene ester amine polymer isomer integral derivative limit "
+    "matrix determinant vector probability parabola ellipse hyperbola sequence"
+).split()
+
+# phrases and word forms the keyword tables look for, plus near misses
+KEYWORD_PIECES = (
+    "Maximum Marks: 300", "Section B", "section-a", "Part IV", "INSTRUCTIONS", "instruction", "question paper",
+    "Statement I and Statement II", "all questions are compulsory", "waves", "Optic", "mechanic", "photoelectric",
+    "electrical", "human body", "human  body", "human-body", "cells", "genetics", "boxidation", "moles", "molecule",
+    "phosphate", "graphs", "using sin", "cosine", "alkanes", "vsepr", "pH", "ionization", "Reaction(s)",
+    "naïve", "café", "x_velocity", "force2", "3acid",
+)
+
+def _timed(fn, *args, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def _texts(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(WORDS).capitalize() if rng.random() < 0.2 else rng.choice(WORDS) for _ in range(rng.randint(8, 60)))
+        for _ in range(count)
+    ]
+
+def bench_fallback_embedder(args):
+    from rag.fallback_embedder import HashingEmbedder
+
+    texts = _texts(args.texts)
+    embedder = HashingEmbedder()
+    reference_s, reference = _timed(embedder.reference_encode, texts, repeat=1)
+    embedder._reset_vocab()
+    cold_s, _ = _timed(embedder.encode, texts, repeat=1)
+    warm_s, batched = _timed(embedder.encode, texts)
+
+    print(f"texts: {len(texts)}")
+    print(f"reference loop: {reference_s:.3f}s ({len(texts) / reference_s:,.0f} texts/s)")
+    print(f"batched, cold vocab: {cold_s:.3f}s ({len(texts) / cold_s:,.0f} texts/s)")
+    print(f"batched, warm vocab: {warm_s:.3f}s ({len(texts) / warm_s:,.0f} texts/s)")
+    identical = np.array_equal(reference, batched)
+    print(f"identical: {identical}")
+    return [] if identical else ["HashingEmbedder.encode"]
+
+def bench_encoders(args):
+    from config import EMBEDDER_NAME, EMBEDDING_ONNX_DIR, EMBEDDING_THREADS
+    from rag.encoders import load_encoder, parity
+
+    texts = _texts(args.texts)
+    reference = None
+    for backend, quantize in (("torch", "none"), ("torch", "int8"), ("onnx", "none"), ("onnx", "int8")):
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            try:
+                encoder = load_encoder(
+                    EMBEDDER_NAME,
+                    backend=backend,
+                    quantize=quantize,
+                    threads=EMBEDDING_THREADS,
+                    batch_size=batch_size,
+                    export_dir=EMBEDDING_ONNX_DIR,
+                )
+            except Exception as exc:
+                print(f"{backend}/{quantize}: unavailable ({exc})")
+                break
+            reference = reference or encoder
+            seconds, _ = _timed(encoder.encode, texts, repeat=1)
+            agreement = parity(encoder, reference)
+            print(
+                f"{encoder.backend:>10} batch {batch_size:>3}: {len(texts) / seconds:,.0f} texts/s, "
+                f"min cosine vs torch {agreement['min_cosine']}"
+            )
+
+def _keyword_texts(count, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for text in _texts(count, seed):
+        words = text.split()
+        for _ in range(rng.randint(0, 4)):
+            words.insert(rng.randint(0, len(words)), rng.choice(KEYWORD_PIECES))
+        texts.append(" ".join(words) + rng.choice(("", "?", ".", " (A) 2 (B) 4")))
+    return texts
+
+def bench_keywords(args):
+    from analytics.weak_topics import _TOPIC_COUNTER, extract_topic_from_text
+    from rag.validation import _META_COUNTER, _SUBJECT_COUNTER, is_meta_question, normalize_text, subject_score_map
+
+    def reference_topic(text):
+        if not text:
+            return "General"
+        best_topic = "General"
+        max_matches = 0
+        for topic, matches in _TOPIC_COUNTER.reference_counts(text.lower()).items():
+            if matches > max_matches:
+                max_matches = matches
+                best_topic = topic.title()
+        return best_topic
+
+    texts = _keyword_texts(args.texts)
+    failures = []
+    cases = (
+        ("subject_score_map", subject_score_map, lambda t: _SUBJECT_COUNTER.reference_counts(normalize_text(t).lower())),
+        ("is_meta_question", is_meta_question, lambda t: _META_COUNTER.reference_search(normalize_text(t).lower())),
+        ("extract_topic_from_text", extract_topic_from_text, reference_topic),
+    )
+    print(f"texts: {len(texts)}")
+    for name, fn, reference_fn in cases:
+        reference_s, reference = _timed(lambda: [reference_fn(text) for text in texts], repeat=1)
+        _TOPIC_COUNTER.memo.clear()
+        _SUBJECT_COUNTER.memo.clear()
+        _META_COUNTER.memo.clear()
+        cold_s, _ = _timed(lambda: [fn(text) for text in texts], repeat=1)
+        warm_s, result = _timed(lambda: [fn(text) for text in texts])
+        print(
+            f"{name}: reference {len(texts) / reference_s:,.0f} texts/s, "
+            f"cold {len(texts) / cold_s:,.0f} texts/s, warm {len(texts) / warm_s:,.0f} texts/s, "
+            f"identical: {reference == result}"
+        )
+        if reference != result:
+            failures.append(name)
+    return failures
+
+# Topic names, free-text topics and subjects candidates may resolve to
+TOPIC_PIECES = (
+    "Mechanics", "mechanics", "Kinematics of motion", "Thermodynamics", "Heat and temperature", "Optics",
+    "Wave Optics", "Light", "Organic Chemistry", "Alcohol reactions", "Inorganic Chemistry", "Calculus",
+    "Integral calculus", "Coordinate Geometry", "circle", "Algebra", "Electromagnetism", "electric current",
+    "Physics", "Chemistry", "General", "",
+)
+
+def bench_topic_scores(args):
+    from rag.retrieval import CandidateRow, _topic_matrix, _topic_scores, _topic_similarity
+
+    rng = random.Random(0)
+    # half the names are Topic rows, the rest only reach retrieval as strings
+    _topic_matrix.add([topic for topic in TOPIC_PIECES[::2] if topic])
+    texts = _texts(args.texts)
+    candidates = []
+    for i, text in enumerate(texts):
+        c = CandidateRow(str(i), rng.choice(("Physics", "Chemistry", "Mathematics")), None, "easy", True, str(i), text)
+        c.topic = rng.choice(TOPIC_PIECES + (None,))
+        candidates.append(c)
+    requests = [
+        (
+            rng.choice(TOPIC_PIECES + (None,) * 4),
+            {rng.choice(TOPIC_PIECES[:-1]): rng.choice((0.1, 0.5, 1.0, -0.3, 2.0)) for _ in range(rng.randint(0, 4))},
+        )
+        for _ in range(20)
+    ]
+
+    def reference(candidates, topic_filter, weights):
+        bonus, matches = [], []
+        for c in candidates:
+            topic = c.resolved_topic()
+            best = 0.0
+            for weak_topic, weight in weights.items():
+                similarity = _topic_similarity(topic, weak_topic)
+                if similarity > 0.25:
+                    best = max(best, similarity * float(weight))
+            bonus.append(best)
+            matches.append(not topic_filter or _topic_similarity(topic_filter, topic) >= 0.25)
+        return bonus, matches
+
+    reference_s, expected = _timed(lambda: [reference(candidates, *request) for request in requests], repeat=1)
+    matrix_s, result = _timed(lambda: [_topic_scores(candidates, *request) for request in requests])
+    identical = all(
+        np.array_equal(np.asarray(bonus), ref_bonus) and np.array_equal(np.asarray(matches), ref_matches)
+        for (bonus, matches), (ref_bonus, ref_matches) in zip(result, expected)
+    )
+    scored = len(candidates) * len(requests)
+    print(f"candidates: {len(candidates)} x {len(requests)} requests")
+    print(f"pair by pair: {reference_s:.3f}s ({scored / reference_s:,.0f} candidates/s)")
+    print(f"matrix: {matrix_s:.3f}s ({scored / matrix_s:,.0f} candidates/s)")
+    print(f"identical: {identical}")
+    return [] if identical else ["_topic_scores"]
+
+BENCHMARKS = {
+    "fallback-embedder": bench_fallback_embedder,
+    "encoders": bench_encoders,
+    "keywords": bench_keywords,
+    "topic-scores": bench_topic_scores,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--texts", type=int, default=20000)
+    parser.add_argument("--batch-sizes", default="16,32,64")
+    args = parser.parse_args()
+    failures = BENCHMARKS[args.benchmark](args)
+    if failures:
+        raise SystemExit(f"outputs differ from the reference: {', '.join(failures)}")
@@ -22,7 +22,8 @@ for p in [PDF_DIR, IMAGE_DIR, STORAGE_DIR, UPLOAD_DIR, VECTOR_CACHE_DIR, LOG_DIR
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{BASE_DIR / 'jeeace.db'}")
 
 # Flask
-SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key")
+DEFAULT_SECRET_KEY = "dev-secret-key"
+SECRET_KEY = os.getenv("SECRET_KEY", DEFAULT_SECRET_KEY)
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:3001").split(",")
 
 # Groq
@@ -33,18 +34,87 @@ GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 # Embeddings / FAISS
 EMBEDDER_NAME = os.getenv("EMBEDDER_NAME", "all-MiniLM-L6-v2")
 EMBEDDING_FALLBACK_ONLY = os.getenv("EMBEDDING_FALLBACK_ONLY", "false").lower() == "true"
+# embedding backend: torch | onnx, optionally with dynamic int8 quantization
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "none").lower()
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# an index embedded by another backend is only queried if the two agree
+EMBEDDING_PARITY_MIN_COSINE = float(os.getenv("EMBEDDING_PARITY_MIN_COSINE", "0.99"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = VECTOR_CACHE_DIR / "embeddings.bin"
+EMBEDDING_ONNX_DIR = VECTOR_CACHE_DIR / "onnx"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+# ranked question ids per retrieval request, invalidated by the corpus version
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+# deepest candidate list a generate request may ask retrieval for
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "2000"))
 QUESTION_INDEX_PATH = STORAGE_DIR / "faiss.index"
 QUESTION_ID_MAP_PATH = STORAGE_DIR / "questions.pkl"
 IMAGE_INDEX_PATH = STORAGE_DIR / "faiss_images.index"
 IMAGE_ID_MAP_PATH = STORAGE_DIR / "images.pkl"
+QUESTION_META_PATH = STORAGE_DIR / "questions_meta.pkl"
+IMAGE_META_PATH = STORAGE_DIR / "images_meta.pkl"
+QUESTION_VECTORS_PATH = STORAGE_DIR / "questions.f32"
+IMAGE_VECTORS_PATH = STORAGE_DIR / "images.f32"
 PROCESSED_PDFS_PATH = STORAGE_DIR / "processed_pdfs.json"
+# committed index snapshots (v<version>/ directories plus a CURRENT pointer);
+# the flat faiss.index / *.pkl files above are only read to migrate old stores
+INDEX_SNAPSHOT_DIR = STORAGE_DIR / "snapshots"
+INDEX_SNAPSHOTS_KEEP = int(os.getenv("INDEX_SNAPSHOTS_KEEP", "2"))
+INDEX_VERIFY_CHECKSUMS = os.getenv("INDEX_VERIFY_CHECKSUMS", "false").lower() == "true"
+# incremental changes journaled after a snapshot before a full one is written
+INDEX_JOURNAL_MAX_ENTRIES = int(os.getenv("INDEX_JOURNAL_MAX_ENTRIES", "200"))
+# memory-map flat and HNSW indexes on load instead of reading them into RAM
+FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() == "true"
+
+# FAISS index type: auto | flat | ivf_flat | ivf_pq | hnsw
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "auto").lower()
+FAISS_ANN_TYPE = os.getenv("FAISS_ANN_TYPE", "ivf_flat").lower()
+FAISS_ANN_THRESHOLD = int(os.getenv("FAISS_ANN_THRESHOLD", "50000"))
+# vector encoding: float32 | fp16 | sq8 | pq; compressed indexes re-rank
+# FAISS_RERANK_FACTOR * k candidates against the exact vectors (0 disables)
+FAISS_STORAGE = os.getenv("FAISS_STORAGE", "float32").lower()
+FAISS_RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "48"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+# optional shared embed/search service (python vector_service.py); a socket
+# path or host:port. When set, get_faiss_store() returns a client for it
+VECTOR_SERVICE_ADDRESS = os.getenv("VECTOR_SERVICE_ADDRESS", "")
+VECTOR_SERVICE_AUTHKEY = os.getenv("VECTOR_SERVICE_AUTHKEY", SECRET_KEY).encode("utf-8")
+VECTOR_SERVICE_BATCH_WINDOW_MS = float(os.getenv("VECTOR_SERVICE_BATCH_WINDOW_MS", "2"))
+VECTOR_SERVICE_MAX_BATCH = int(os.getenv("VECTOR_SERVICE_MAX_BATCH", "64"))
+
+# lexical retrieval: BM25 parameters and the reciprocal rank fusion constant
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
 
 # Runtime
 AUTO_INGEST_ON_STARTUP = os.getenv("AUTO_INGEST_ON_STARTUP", "true").lower() == "true"
+# load the index and embedding model in a background thread at app start
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# requests arriving before warm-up finishes: "wait" up to EMBEDDER_WAIT_TIMEOUT
+# seconds for the model, or "sql" to answer from SQL-only candidates at once
+EMBEDDER_NOT_READY_MODE = os.getenv("EMBEDDER_NOT_READY_MODE", "wait").lower()
+EMBEDDER_WAIT_TIMEOUT = float(os.getenv("EMBEDDER_WAIT_TIMEOUT", "10"))
 MAX_GENERATE_COUNT = int(os.getenv("MAX_GENERATE_COUNT", "75"))
+# LLM MCQ conversions a generate request runs at once
+MCQ_GENERATION_WORKERS = int(os.getenv("MCQ_GENERATION_WORKERS", "8"))
 DEFAULT_TIME_LIMIT = int(os.getenv("DEFAULT_TIME_LIMIT", "3600"))
 
 # Matching thresholds
 MIN_IMAGE_SIMILARITY = float(os.getenv("MIN_IMAGE_SIMILARITY", "0.58"))
 MIN_IMAGE_OVERLAP = int(os.getenv("MIN_IMAGE_OVERLAP", "2"))
 MIN_QUESTION_SIMILARITY = float(os.getenv("MIN_QUESTION_SIMILARITY", "0.45"))
+# near-duplicate questions: estimated shingle Jaccard similarity at which a
+# new question joins an existing cluster
+NEAR_DUPLICATE_MIN_JACCARD = float(os.getenv("NEAR_DUPLICATE_MIN_JACCARD", "0.7"))
+# nearest-centroid topics: cosine a question needs with its closest topic
+# centroid, otherwise it keeps the subject-level topic
+TOPIC_MIN_SIMILARITY = float(os.getenv("TOPIC_MIN_SIMILARITY", "0.1"))
@@ -0,0 +1,23 @@
+from database.models import CorpusState, utcnow
+
+CORPUS_STATE_ID = 1
+
+def corpus_version(session):
+    version = session.query(CorpusState.version).filter(CorpusState.id == CORPUS_STATE_ID).scalar()
+    return version or 0
+
+def bump_corpus_version(session):
+    """
+    Mark the question bank as changed for every worker. Part of the caller's
+    transaction, so the new version is visible exactly when its rows are.
+    """
+    updated = (
+        session.query(CorpusState)
+        .filter(CorpusState.id == CORPUS_STATE_ID)
+        .update(
+            {CorpusState.version: CorpusState.version + 1, CorpusState.updated_at: utcnow()},
+            synchronize_session=False,
+        )
+    )
+    if not updated:
+        session.add(CorpusState(id=CORPUS_STATE_ID, version=1))
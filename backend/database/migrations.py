@@ -0,0 +1,34 @@
+from sqlalchemy import inspect, text
+
+from database.db import db
+
+def ensure_schema():
+    """
+    db.create_all() only creates missing tables. Add any model column or
+    index that an existing table is missing; added columns are nullable and
+    filled in by `python backfill.py`.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                added.append(f"{table.name}.{column.name}")
+
+        indexes = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=engine)
+                added.append(index.name)
+    if added:
+        print(f"Schema updated: {', '.join(added)}")
+    return added
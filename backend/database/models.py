@@ -22,6 +22,14 @@ class PDFDocument(db.Model):
     questions = db.relationship("Question", back_populates="pdf", cascade="all, delete-orphan", lazy=True)
     images = db.relationship("ImageAsset", back_populates="pdf", cascade="all, delete-orphan", lazy=True)
 
+class Topic(db.Model):
+    """Distinct Question.topic values; retrieval keys its topic similarity matrix on these."""
+
+    __tablename__ = "topics"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+
 class Question(db.Model):
     __tablename__ = "questions"
 
@@ -35,8 +43,16 @@ class Question(db.Model):
 
     subject = db.Column(db.String(100), nullable=True, index=True)
     topic = db.Column(db.String(120), nullable=True, index=True)
+    topic_id = db.Column(db.Integer, db.ForeignKey("topics.id"), nullable=True, index=True)
     difficulty = db.Column(db.String(30), default="medium", index=True)
 
+    # computed at ingest from question_text (NULL until backfilled on older rows)
+    is_valid = db.Column(db.Boolean, nullable=True, index=True)
+    text_hash = db.Column(db.String(40), nullable=True, index=True)
+    # MinHash signature of question_text and the near-duplicate cluster it joined
+    minhash = db.Column(db.LargeBinary, nullable=True)
+    cluster_id = db.Column(db.String(36), nullable=True, index=True)
+
     page = db.Column(db.Integer, nullable=True, index=True)
     source_pdf = db.Column(db.String(255), nullable=False)
 
@@ -49,6 +65,13 @@ class Question(db.Model):
 
     pdf = db.relationship("PDFDocument", back_populates="questions")
     image_links = db.relationship("QuestionImageAssociation", back_populates="question", cascade="all, delete-orphan", lazy=True)
+    lsh_buckets = db.relationship("QuestionLSHBucket", back_populates="question", cascade="all, delete-orphan", lazy=True)
+
+    __table_args__ = (
+        db.Index("ix_questions_subject_valid_created", "subject", "is_valid", "created_at"),
+        # covers the per-cluster MIN(created_at) of filter_question_ids_by_subject
+        db.Index("ix_questions_subject_valid_cluster", "subject", "is_valid", "cluster_id", "created_at", "id"),
+    )
 
     def to_dict(self):
         return {
@@ -67,6 +90,17 @@ class Question(db.Model):
             "solution": self.solution,
         }
 
+class QuestionLSHBucket(db.Model):
+    """One row per MinHash band of a question, for near-duplicate lookups."""
+
+    __tablename__ = "question_lsh_buckets"
+
+    question_id = db.Column(db.String(36), db.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True)
+    band = db.Column(db.SmallInteger, primary_key=True)
+    bucket = db.Column(db.BigInteger, nullable=False, index=True)
+
+    question = db.relationship("Question", back_populates="lsh_buckets")
+
 class ImageAsset(db.Model):
     __tablename__ = "images"
 
@@ -158,3 +192,12 @@ class WeakTopic(db.Model):
     subject = db.Column(db.String(100), nullable=True, index=True)
     weight = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+class CorpusState(db.Model):
+    """Single row whose version is bumped whenever the question bank changes."""
+
+    __tablename__ = "corpus_state"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
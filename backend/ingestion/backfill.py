@@ -0,0 +1,145 @@
+import numpy as np
+from sqlalchemy import func
+
+from database.corpus import bump_corpus_version
+from database.models import Question, QuestionLSHBucket
+from rag.near_duplicates import SIGNATURE_BYTES, ClusterIndex, lsh_buckets, minhash
+from rag.topic_classifier import TopicClassifier
+from rag.validation import is_valid_question_text, question_text_hash
+
+def _question_pages(session, columns, missing, batch_size):
+    # keyset pagination on the primary key, so updates never shift a page
+    last_id = ""
+    while True:
+        query = session.query(Question.id, *columns).filter(Question.id > last_id)
+        if missing is not None:
+            query = query.filter(missing)
+        rows = query.order_by(Question.id.asc()).limit(batch_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def backfill_question_keys(session, batch_size=1000, recompute=False):
+    """Fill is_valid and text_hash for rows ingested before they existed."""
+    missing = None if recompute else (Question.is_valid.is_(None) | Question.text_hash.is_(None))
+    updated = 0
+    for rows in _question_pages(session, [Question.question_text], missing, batch_size):
+        session.bulk_update_mappings(Question, [
+            {
+                "id": question_id,
+                "is_valid": is_valid_question_text(question_text or ""),
+                "text_hash": question_text_hash(question_text),
+            }
+            for question_id, question_text in rows
+        ])
+        session.commit()
+        updated += len(rows)
+    if updated:
+        bump_corpus_version(session)
+        session.commit()
+    return updated
+
+def backfill_question_topics(session, batch_size=1000, recompute=False):
+    """Point topic_id at the topics table for rows ingested before it existed."""
+    from ingestion.ingest import topic_ids
+
+    missing = Question.topic.isnot(None) & (Question.topic != "")
+    if not recompute:
+        missing = missing & Question.topic_id.is_(None)
+    updated = 0
+    for rows in _question_pages(session, [Question.topic], missing, batch_size):
+        ids = topic_ids(session, [topic for _, topic in rows])
+        session.bulk_update_mappings(Question, [
+            {"id": question_id, "topic_id": ids.get(topic)} for question_id, topic in rows
+        ])
+        session.commit()
+        updated += len(rows)
+    if updated:
+        bump_corpus_version(session)
+        session.commit()
+    return updated
+
+def backfill_question_classified_topics(session, store, batch_size=1000, recompute=False):
+    """
+    Classify questions still carrying a subject-level topic into TOPIC_MAP
+    topics, from the vectors already stored in the index (embedding only
+    questions missing from it). Updates topic, topic_id and the index's
+    topic filter metadata; returns the number of questions changed.
+    """
+    from analytics.weak_topics import TOPIC_MAP
+    from ingestion.ingest import topic_ids
+
+    classifier = TopicClassifier(TOPIC_MAP, store.embed_texts)
+    missing = None if recompute else (Question.topic.is_(None) | Question.topic.notin_(classifier.names))
+    columns = [Question.subject, Question.topic, Question.embedding_text, Question.question_text]
+    changed = {}
+    for rows in _question_pages(session, columns, missing, batch_size):
+        vectors = store.question_vectors([row[0] for row in rows])
+        unindexed = np.flatnonzero(~vectors.any(axis=1))
+        if len(unindexed):
+            vectors[unindexed] = store.embed_texts([rows[i][3] or rows[i][4] for i in unindexed])
+        topics = classifier.classify(vectors, [row[1] for row in rows], [row[2] for row in rows])
+        updates = [(row[0], topic) for row, topic in zip(rows, topics) if topic != row[2]]
+        if not updates:
+            continue
+        ids = topic_ids(session, [topic for _, topic in updates])
+        session.bulk_update_mappings(Question, [
+            {"id": question_id, "topic": topic, "topic_id": ids.get(topic)} for question_id, topic in updates
+        ])
+        session.commit()
+        changed.update((question_id, {"topic": topic}) for question_id, topic in updates)
+    if changed:
+        store.update_question_metadata(changed)
+        bump_corpus_version(session)
+        session.commit()
+    return len(changed)
+
+def backfill_question_clusters(session, batch_size=1000, recompute=False):
+    """
+    Compute missing MinHash signatures and LSH buckets, then cluster the
+    unclustered questions oldest first against every clustered one.
+    Returns (signatures computed, questions clustered).
+    """
+    # signatures from before the numbers digest are recomputed too
+    missing = None if recompute else (
+        Question.minhash.is_(None) | (func.length(Question.minhash) != SIGNATURE_BYTES)
+    )
+    signed = 0
+    for rows in _question_pages(session, [Question.question_text], missing, batch_size):
+        ids = [question_id for question_id, _ in rows]
+        signatures = {question_id: minhash(question_text) for question_id, question_text in rows}
+        session.query(QuestionLSHBucket).filter(QuestionLSHBucket.question_id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        session.bulk_update_mappings(Question, [
+            {"id": question_id, "minhash": signature} for question_id, signature in signatures.items()
+        ])
+        session.bulk_insert_mappings(QuestionLSHBucket, [
+            {"question_id": question_id, "band": band, "bucket": bucket}
+            for question_id, signature in signatures.items()
+            for band, bucket in enumerate(lsh_buckets(signature))
+        ])
+        session.commit()
+        signed += len(rows)
+
+    clusters = ClusterIndex()
+    assigned = []
+    rows = (
+        session.query(Question.id, Question.minhash, Question.cluster_id)
+        .order_by(Question.created_at.asc(), Question.id.asc())
+        .yield_per(batch_size)
+    )
+    for question_id, signature, cluster_id in rows:
+        if cluster_id is not None and not recompute:
+            clusters.add(signature, cluster_id)
+        else:
+            assigned.append({"id": question_id, "cluster_id": clusters.assign(signature, question_id)})
+
+    for start in range(0, len(assigned), batch_size):
+        session.bulk_update_mappings(Question, assigned[start:start + batch_size])
+        session.commit()
+    if assigned:
+        bump_corpus_version(session)
+        session.commit()
+    return signed, len(assigned)
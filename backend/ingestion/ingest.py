@@ -3,10 +3,17 @@ import hashlib
 import json
 from pathlib import Path
 
+from sqlalchemy import func
+
+from analytics.weak_topics import TOPIC_MAP
 from config import PDF_DIR, IMAGE_DIR, STORAGE_DIR, PROCESSED_PDFS_PATH
-from database.models import PDFDocument, Question, ImageAsset, QuestionImageAssociation
+from database.corpus import bump_corpus_version
+from database.models import PDFDocument, Question, ImageAsset, QuestionImageAssociation, QuestionLSHBucket, Topic
 from ingestion.pdf_processor import process_pdf_file
-from rag.embeddings import get_faiss_store
+from rag.embeddings import get_faiss_store, question_embedding_text
+from rag.near_duplicates import ClusterIndex, lsh_buckets
+from rag.topic_classifier import TopicClassifier
+from rag.validation import is_valid_question_text, question_text_hash
 
 def calculate_file_hash(file_path):
     hasher = hashlib.md5()
@@ -30,11 +37,81 @@ def save_processed_pdfs(data):
     PROCESSED_PDFS_PATH.parent.mkdir(parents=True, exist_ok=True)
     PROCESSED_PDFS_PATH.write_text(json.dumps(data, indent=2), encoding="utf-8")
 
+def _drop_pdf_document(session, pdf_doc):
+    question_ids = [row[0] for row in session.query(Question.id).filter(Question.pdf_id == pdf_doc.id).all()]
+    image_ids = [row[0] for row in session.query(ImageAsset.id).filter(ImageAsset.pdf_id == pdf_doc.id).all()]
+    session.delete(pdf_doc)
+    bump_corpus_version(session)
+    session.commit()
+
+    store = get_faiss_store()
+    store.remove_questions(question_ids)
+    store.remove_images(image_ids)
+
+def load_cluster_index(session, buckets, chunk_size=1000):
+    """ClusterIndex of the stored questions that share an LSH bucket with buckets."""
+    clusters = ClusterIndex()
+    buckets = list(set(buckets))
+    seen = set()
+    for start in range(0, len(buckets), chunk_size):
+        rows = (
+            session.query(Question.id, Question.minhash, Question.cluster_id)
+            .join(QuestionLSHBucket, QuestionLSHBucket.question_id == Question.id)
+            .filter(QuestionLSHBucket.bucket.in_(buckets[start:start + chunk_size]))
+            .filter(Question.cluster_id.isnot(None))
+            .all()
+        )
+        for question_id, signature, cluster_id in rows:
+            if question_id not in seen:
+                seen.add(question_id)
+                clusters.add(signature, cluster_id)
+    return clusters
+
+def assign_clusters(session, extracted_questions):
+    """
+    Put each new question in the cluster of its closest near-duplicate,
+    from the bank or earlier in the same PDF, or in a new cluster of its own.
+    """
+    buckets = {q["id"]: lsh_buckets(q["minhash"]) for q in extracted_questions}
+    clusters = load_cluster_index(session, [b for bs in buckets.values() for b in bs])
+    for q in extracted_questions:
+        q["cluster_id"] = clusters.assign(q["minhash"], q["id"])
+    return buckets
+
+def classify_topics(store, extracted_questions):
+    """
+    Replace each question's subject-level topic with its nearest TOPIC_MAP
+    topic by embedding. Returns the embeddings for add_questions to reuse.
+    """
+    if not extracted_questions:
+        return None
+    vectors = store.embed_texts([question_embedding_text(q) for q in extracted_questions])
+    topics = TopicClassifier(TOPIC_MAP, store.embed_texts).classify(
+        vectors,
+        [q.get("subject") for q in extracted_questions],
+        [q.get("topic") for q in extracted_questions],
+    )
+    for q, topic in zip(extracted_questions, topics):
+        q["topic"] = topic
+    return vectors
+
+def topic_ids(session, names):
+    """Topic.id of each topic name, creating the topics not seen before."""
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    ids = dict(session.query(Topic.name, Topic.id).filter(Topic.name.in_(names)).all())
+    for name in sorted(names - ids.keys()):
+        topic = Topic(name=name)
+        session.add(topic)
+        session.flush()
+        ids[name] = topic.id
+    return ids
+
 def delete_existing_pdf_record(session, filename):
     existing = session.query(PDFDocument).filter(PDFDocument.filename == filename).first()
     if existing:
-        session.delete(existing)
-        session.commit()
+        _drop_pdf_document(session, existing)
 
 def ingest_single_pdf(session, pdf_path):
     pdf_path = Path(pdf_path)
@@ -54,10 +131,12 @@ def ingest_single_pdf(session, pdf_path):
         }
 
     if existing:
-        session.delete(existing)
-        session.commit()
+        _drop_pdf_document(session, existing)
 
     extracted_questions, extracted_images, associations = process_pdf_file(str(pdf_path), IMAGE_DIR)
+    question_buckets = assign_clusters(session, extracted_questions)
+    store = get_faiss_store()
+    question_vectors = classify_topics(store, extracted_questions)
 
     pdf_doc = PDFDocument(
         filename=filename,
@@ -69,18 +148,25 @@ def ingest_single_pdf(session, pdf_path):
     session.add(pdf_doc)
     session.flush()  # get pdf_doc.id
 
+    topic_id_map = topic_ids(session, [q.get("topic") for q in extracted_questions])
     question_id_map = {}
     for q in extracted_questions:
+        question_text = q.get("text") or q.get("raw_text") or ""
         qrec = Question(
             id=q["id"],
             pdf_id=pdf_doc.id,
             question_number=q.get("question_number"),
             raw_text=q.get("raw_text") or q.get("text") or "",
-            question_text=q.get("text") or q.get("raw_text") or "",
+            question_text=question_text,
             embedding_text=q.get("embedding_text") or q.get("text") or q.get("raw_text") or "",
             subject=q.get("subject"),
             topic=q.get("topic"),
+            topic_id=topic_id_map.get(q.get("topic")),
             difficulty=q.get("difficulty", "medium"),
+            is_valid=is_valid_question_text(question_text),
+            text_hash=question_text_hash(question_text),
+            minhash=q["minhash"],
+            cluster_id=q["cluster_id"],
             page=q.get("page"),
             source_pdf=q.get("source_pdf", filename),
             options=q.get("options"),
@@ -88,6 +174,9 @@ def ingest_single_pdf(session, pdf_path):
             answer_text=q.get("answer_text"),
             solution=q.get("solution"),
         )
+        qrec.lsh_buckets = [
+            QuestionLSHBucket(band=band, bucket=bucket) for band, bucket in enumerate(question_buckets[q["id"]])
+        ]
         session.add(qrec)
         question_id_map[q["id"]] = qrec
 
@@ -121,8 +210,12 @@ def ingest_single_pdf(session, pdf_path):
                 association_type=assoc.get("association_type", "semantic_strict"),
             ))
 
+    bump_corpus_version(session)
     session.commit()
 
+    store.add_questions(extracted_questions, vectors=question_vectors)
+    store.add_images(extracted_images)
+
     return {
         "filename": filename,
         "skipped": False,
@@ -152,9 +245,13 @@ def ingest_all_pdfs(session):
         processed[pdf_path.name] = {"hash": file_hash, "processed": True}
 
     save_processed_pdfs(processed)
-    get_faiss_store().rebuild_from_db(
-        session,
-        Question,
-        ImageAsset
-    )    
+
+    # new PDFs were indexed as they were ingested; only fall back to a full
+    # rebuild when the on-disk index has drifted from the database
+    store = get_faiss_store()
+    if not store.is_consistent(
+        session.query(func.count(Question.id)).scalar(),
+        session.query(func.count(ImageAsset.id)).scalar(),
+    ):
+        store.rebuild_from_db(session, Question, ImageAsset)
     return report
@@ -6,6 +6,7 @@ from pathlib import Path
 from typing import Dict, List, Tuple
 
 import fitz
+import numpy as np
 from PIL import Image as PILImage
 
 from config import IMAGE_DIR, MIN_IMAGE_SIMILARITY, MIN_IMAGE_OVERLAP
@@ -19,6 +20,7 @@ from rag.validation import (
     image_relevance_score,
 )
 from rag.embeddings import get_faiss_store
+from rag.near_duplicates import minhash
 
 QUESTION_PATTERNS = [
     r'(\d+\.\s+.*?(?=\d+\.\s+|\n\n|\Z))',
@@ -116,6 +118,7 @@ def extract_questions_from_text(text, page_num, filename, subject):
                 "raw_text": candidate,
                 "text": qtext,
                 "embedding_text": embedding_text,
+                "minhash": minhash(qtext),
                 "options": opts,
                 "page": page_num + 1,
                 "source_pdf": filename,
@@ -212,10 +215,26 @@ def process_pdf_file(pdf_path, output_dir=IMAGE_DIR):
         if page_answer_map:
             answer_maps.append(page_answer_map)
 
-        for image_data in extract_images_from_page(doc, page, page_num, filename, current_subject, output_dir):
-            extracted_images.append(image_data)
+        page_images = extract_images_from_page(doc, page, page_num, filename, current_subject, output_dir)
+        extracted_images.extend(page_images)
 
-            for question in questions_on_page:
+        # embed every question and image on the page in one call, then
+        # score all pairs from the same vectors
+        q_vecs = i_vecs = None
+        if page_images and questions_on_page:
+            try:
+                texts = [question.get("text", "") for question in questions_on_page]
+                texts += [img["caption"] + " " + img["surrounding_text"][:500] for img in page_images]
+                vectors = get_faiss_store().embed_texts(texts)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = vectors / np.where(norms > 0, norms, 1.0)
+                q_vecs = vectors[:len(questions_on_page)]
+                i_vecs = vectors[len(questions_on_page):]
+            except Exception:
+                q_vecs = i_vecs = None
+
+        for image_index, image_data in enumerate(page_images):
+            for question_index, question in enumerate(questions_on_page):
                 q_text = question.get("text", "")
                 q_subject = question.get("subject", current_subject)
 
@@ -226,14 +245,8 @@ def process_pdf_file(pdf_path, output_dir=IMAGE_DIR):
                     continue
 
                 similarity_score = 0.0
-                try:
-                    from sklearn.metrics.pairwise import cosine_similarity as _cos
-                    q_vec = get_faiss_store().embed_texts([q_text])
-                    image_text = image_data["caption"] + " " + image_data["surrounding_text"][:500]
-                    i_vec = get_faiss_store().embed_texts([image_text])
-                    similarity_score = float(_cos(q_vec, i_vec)[0][0])
-                except Exception:
-                    similarity_score = 0.0
+                if q_vecs is not None:
+                    similarity_score = float(q_vecs[question_index] @ i_vecs[image_index])
 
                 # caller may compute embeddings later; we keep a lightweight lexical overlap gate here
                 overlap_score = image_relevance_score(q_text, image_data["caption"], image_data["surrounding_text"])
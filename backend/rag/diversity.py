@@ -0,0 +1,37 @@
+import numpy as np
+
+def mmr_order(relevance, vectors, diversity, select=None):
+    """
+    Maximal marginal relevance ordering. Each step picks the candidate with
+    the best (1 - diversity) * relevance - diversity * (highest cosine
+    similarity to an earlier pick); relevance is min-max scaled to [0, 1]
+    first so both terms share a range. The first `select` positions are MMR
+    picks and the remaining candidates follow in their given order.
+    Returns indices into relevance / vectors.
+    """
+    n = len(relevance)
+    select = n if select is None else min(select, n)
+    if n < 2 or diversity <= 0 or select <= 0:
+        return list(range(n))
+
+    relevance = np.asarray(relevance, dtype="float32")
+    span = float(relevance.max() - relevance.min())
+    relevance = (relevance - relevance.min()) / span if span > 0 else np.zeros(n, dtype="float32")
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    base = (1.0 - diversity) * relevance
+    closest = np.zeros(n, dtype="float32")
+    available = np.ones(n, dtype=bool)
+    picks = []
+    for _ in range(select):
+        scores = base - diversity * closest
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        picks.append(pick)
+        available[pick] = False
+        # one matrix-vector product per pick; cheaper than a full Gram
+        # matrix while select (the test size) is well below n
+        np.maximum(closest, vectors @ vectors[pick], out=closest)
+    return picks + np.flatnonzero(available).tolist()
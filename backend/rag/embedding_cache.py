@@ -0,0 +1,215 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts
+    fcntl = None
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache.
+
+    Entries are keyed by sha1(model name + normalized text) and stored as
+    fixed-size records (20-byte digest + float32 vector) in one append-only
+    file that is read through a memory map. Several processes may share the
+    file: appends and compaction both take an flock on a sidecar lock file,
+    and compaction writes a new file and renames it into place. Each
+    process maps the file through a handle it keeps open, so its row
+    offsets stay valid until it notices a new inode at the path and
+    re-indexes; rows other processes appended are picked up the same way.
+    When the file grows past max_entries the least recently used entries
+    (rows this process never touched first) are compacted away.
+    """
+
+    def __init__(self, path, dim, max_entries):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+        self.dim = dim
+        self.max_entries = max_entries
+        self.dtype = np.dtype([("key", "u1", (20,)), ("vector", "<f4", (dim,))])
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._file = None
+        self._records = None
+        self._load()
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha1(f"{model_name}\x00{text}".encode("utf-8")).digest()
+
+    def _file_rows(self):
+        if self._file is None:
+            return 0
+        return os.fstat(self._file.fileno()).st_size // self.dtype.itemsize
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        self._records = None
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            self._file = None
+            self.identity = None
+            return
+        stat = os.fstat(self._file.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+
+    def _load(self):
+        self._open()
+        self.size = 0
+        self.rows = {}
+        self.stamps = np.zeros(0, dtype="int64")
+        self.tick = 0
+        self._index_new_rows()
+
+    def _index_new_rows(self):
+        """Add rows appended to the open file (by any process) since the last look."""
+        size = self._file_rows()
+        if size <= self.size:
+            return
+        keys = np.asarray(np.memmap(self._file, dtype=self.dtype, mode="r", shape=(size,))["key"][self.size:])
+        for offset, key in enumerate(keys):
+            self.rows[key.tobytes()] = self.size + offset
+        # rows from other processes count as least recently used here
+        stamps = np.full(size, -1, dtype="int64")
+        stamps[:self.size] = self.stamps[:self.size]
+        if not self.size:
+            stamps[:] = np.arange(size)
+            self.tick = size
+        self.stamps = stamps
+        self.size = size
+        self._records = None
+
+    def _sync(self):
+        """Re-index if another process compacted the file, else pick up its appends."""
+        try:
+            stat = os.stat(self.path)
+            identity = (stat.st_dev, stat.st_ino)
+        except FileNotFoundError:
+            identity = None
+        if identity != self.identity:
+            self._load()
+        else:
+            self._index_new_rows()
+
+    def _view(self):
+        records = self._records
+        if records is None or records.shape[0] != self.size:
+            records = np.memmap(self._file, dtype=self.dtype, mode="r", shape=(self.size,))
+            self._records = records
+        return records
+
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return open(self.lock_path, "a+b")
+
+    def lookup(self, model_name, texts):
+        """
+        Return (vectors, missing, keys). Rows of vectors listed in missing
+        are zero and must be computed by the caller and passed to store().
+        """
+        keys = [self.key(model_name, text) for text in texts]
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        missing = []
+        with self.lock:
+            self._sync()
+            positions = []
+            rows = []
+            for position, key in enumerate(keys):
+                row = self.rows.get(key)
+                if row is None:
+                    missing.append(position)
+                    continue
+                positions.append(position)
+                rows.append(row)
+                self.stamps[row] = self.tick
+                self.tick += 1
+            if rows:
+                vectors[positions] = self._view()["vector"][rows]
+            self.hits += len(rows)
+            self.misses += len(missing)
+        return vectors, missing, keys
+
+    def store(self, keys, vectors):
+        with self.lock, self._locked() as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._store(keys, vectors)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _store(self, keys, vectors):
+        # under the flock: nobody else appends or compacts until we are done
+        self._sync()
+        fresh = {}
+        for key, vector in zip(keys, vectors):
+            if key not in self.rows:
+                fresh[key] = vector
+        if not fresh:
+            return
+
+        records = np.zeros(len(fresh), dtype=self.dtype)
+        records["key"] = np.frombuffer(b"".join(fresh), dtype="u1").reshape(-1, 20)
+        records["vector"] = np.asarray(list(fresh.values()), dtype="float32")
+
+        with open(self.path, "ab") as f:
+            # a crash mid-append can leave a partial record that must go
+            end = f.seek(0, os.SEEK_END)
+            if end % self.dtype.itemsize:
+                end -= end % self.dtype.itemsize
+                f.truncate(end)
+            f.write(records.tobytes())
+            f.flush()
+        if self._file is None:
+            self._open()
+        self._index_new_rows()
+        for key in fresh:
+            self.stamps[self.rows[key]] = self.tick
+            self.tick += 1
+
+        if len(self.rows) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        keep = int(self.max_entries * 0.9)
+        rows = np.fromiter(self.rows.values(), dtype="int64", count=len(self.rows))
+        rows = np.sort(rows[np.argsort(self.stamps[rows], kind="stable")[-keep:]])
+        kept = np.array(self._view()[rows])
+        stamps = self.stamps[rows]
+
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(kept.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        self.evictions += len(self.rows) - len(rows)
+        self._open()
+        self.rows = {kept["key"][row].tobytes(): row for row in range(len(kept))}
+        self.stamps = stamps
+        self.size = len(kept)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.rows),
+                "max_entries": self.max_entries,
+                "bytes": self.size * self.dtype.itemsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -1,38 +1,198 @@
 
 import pickle
-import hashlib
 import threading
 import numpy as np
 import faiss
+from sqlalchemy.orm import joinedload
 
 print("LOADING embeddings")
 
 from config import (
     EMBEDDER_NAME,
     EMBEDDING_FALLBACK_ONLY,
+    EMBEDDING_BACKEND,
+    EMBEDDING_QUANTIZE,
+    EMBEDDING_THREADS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_PARITY_MIN_COSINE,
     QUESTION_INDEX_PATH,
     QUESTION_ID_MAP_PATH,
     IMAGE_INDEX_PATH,
     IMAGE_ID_MAP_PATH,
+    QUESTION_META_PATH,
+    IMAGE_META_PATH,
+    QUESTION_VECTORS_PATH,
+    IMAGE_VECTORS_PATH,
+    INDEX_SNAPSHOT_DIR,
+    INDEX_SNAPSHOTS_KEEP,
+    INDEX_VERIFY_CHECKSUMS,
+    INDEX_JOURNAL_MAX_ENTRIES,
+    FAISS_MMAP,
+    FAISS_RERANK_FACTOR,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    QUERY_CACHE_SIZE,
+    VECTOR_SERVICE_ADDRESS,
+    BM25_K1,
+    BM25_B,
 )
+from rag.embedding_cache import EmbeddingCache
+from rag.encoders import backend_label, load_encoder, parity
+from rag.fallback_embedder import HashingEmbedder
+from rag.lru import LRUCache
+from rag.filters import FILTER_FIELDS, MetadataIndex, bitmap_selector
+from rag.id_map import IdMap
+from rag.lexical import BM25Index
+from rag.index_factory import (
+    build_index,
+    choose_index_type,
+    choose_storage,
+    export_vectors,
+    index_labels,
+    index_type_of,
+    is_upgrade,
+    search_params,
+    storage_of,
+    storage_report,
+    supports_remove,
+)
+from rag.snapshots import SnapshotDirectory, SnapshotError
+from rag.vector_file import VectorFile
 from rag.validation import normalize_text
 
+EMBEDDING_DIM = 384
+FALLBACK_MODEL_NAME = "hashing-fallback"
+
+# legacy flat files; current stores keep these inside snapshot directories
+KINDS = {
+    "questions": {
+        "index": QUESTION_INDEX_PATH,
+        "id_map": QUESTION_ID_MAP_PATH,
+        "metadata": QUESTION_META_PATH,
+        "vectors": QUESTION_VECTORS_PATH,
+    },
+    "images": {
+        "index": IMAGE_INDEX_PATH,
+        "id_map": IMAGE_ID_MAP_PATH,
+        "metadata": IMAGE_META_PATH,
+        "vectors": IMAGE_VECTORS_PATH,
+    },
+}
+
+def _question_metadata(q):
+    return {
+        "subject": q.get("subject"),
+        "difficulty": q.get("difficulty"),
+        "topic": q.get("topic"),
+        "source_pdf": q.get("source_pdf"),
+    }
+
+def question_embedding_text(q):
+    """The text a question record is embedded and BM25-indexed by."""
+    return q.get("embedding_text") or q.get("question_text") or q.get("text") or q.get("question")
+
+def _image_metadata(img):
+    return {
+        "subject": img.get("subject"),
+        "source_pdf": img.get("source_pdf"),
+    }
+
+def collect_rebuild_rows(session, Question, ImageAsset):
+    questions = session.query(Question).order_by(Question.created_at.asc()).all()
+    images = (
+        session.query(ImageAsset)
+        .options(joinedload(ImageAsset.pdf))
+        .order_by(ImageAsset.created_at.asc())
+        .all()
+    )
+    return {
+        "questions": (
+            [q.id for q in questions],
+            [q.embedding_text or q.question_text for q in questions],
+            [_question_metadata(q.to_dict()) for q in questions],
+        ),
+        "images": (
+            [img.id for img in images],
+            [(img.caption or "") + " " + (img.surrounding_text or "")[:500] for img in images],
+            [{"subject": img.subject, "source_pdf": img.pdf.filename if img.pdf else None} for img in images],
+        ),
+    }
+
+class IndexSnapshot:
+    """
+    One published index with its id map, filter metadata and BM25 lexical
+    index, all over the same labels. Snapshots are
+    never mutated after publication: writers copy, modify and swap in a new
+    one, so readers can search whatever snapshot they picked up without a
+    lock.
+    """
+
+    __slots__ = ("index", "id_map", "metadata", "lexical", "version", "mapped", "vectors")
+
+    def __init__(self, index, id_map, metadata, lexical, version=0, mapped=False, vectors=None):
+        self.index = index
+        self.id_map = id_map
+        self.metadata = metadata
+        self.lexical = lexical
+        self.version = version
+        # the index views a memory-mapped snapshot file and cannot grow
+        self.mapped = mapped
+        # exact vector rows for this snapshot's labels
+        self.vectors = vectors
+
 class FaissStore:
     def __init__(self):
         self.embedder = None
         self.embedder_failed = False
-        self.lock = threading.RLock()
+        self.embedder_lock = threading.Lock()
+        self.fallback_embedder = HashingEmbedder(EMBEDDING_DIM)
+        # serializes writers only; searches read self.snapshots without it
+        self.write_lock = threading.RLock()
 
-        self.question_index = None
-        self.image_index = None
-
-        self.question_ids = []
-        self.image_ids = []
+        self.snapshots = {}
+        self.snapshot_dir = SnapshotDirectory(INDEX_SNAPSHOT_DIR, keep=INDEX_SNAPSHOTS_KEEP)
+        self.snapshot_name = None
+        # changes journaled on top of snapshot_name since it was written
+        self.journal_entries = 0
+        self.needs_rebuild = False
+        # backend that embedded the loaded snapshot, and the parity check
+        # run when the configured backend differs from it
+        self.index_backend = None
+        self.parity = None
+        # the configured encoder, held back while queries keep using the
+        # index's own backend after a failed parity check, until a rebuild
+        self.rebuild_embedder = None
+        self.semantic_disabled = False
+        self.vectors = {kind: VectorFile(paths["vectors"], EMBEDDING_DIM) for kind, paths in KINDS.items()}
+        self.query_cache = LRUCache(QUERY_CACHE_SIZE)
+        self.embedding_cache = None
+        if EMBEDDING_CACHE_ENABLED:
+            try:
+                self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_DIM, EMBEDDING_CACHE_MAX_ENTRIES)
+            except Exception as exc:
+                print(f"Embedding cache unavailable: {exc}")
 
         self._load_or_init()
 
     def _new_index(self):
-        return faiss.IndexFlatL2(384)
+        return build_index("flat", EMBEDDING_DIM)
+
+    def _build_index(self, labels, vectors):
+        index_type = choose_index_type(len(vectors))
+        storage = choose_storage(len(vectors), index_type)
+        index = build_index(index_type, EMBEDDING_DIM, vectors, storage)
+        if len(vectors):
+            index.add_with_ids(vectors, labels)
+        return index
+
+    def _upgrade_legacy_index(self, index):
+        # indexes written before ID mapping are positional flat indexes
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF)):
+            return index
+        labels = np.arange(index.ntotal, dtype="int64")
+        return self._build_index(labels, index.reconstruct_n(0, index.ntotal))
 
     def _get_embedder(self):
         if EMBEDDING_FALLBACK_ONLY:
@@ -40,162 +200,780 @@ class FaissStore:
             return None
         if self.embedder or self.embedder_failed:
             return self.embedder
+        with self.embedder_lock:
+            if self.embedder or self.embedder_failed:
+                return self.embedder
+            try:
+                encoder = self._load_encoder(EMBEDDING_BACKEND, EMBEDDING_QUANTIZE)
+                self.embedder = self._check_parity(encoder)
+            except Exception as exc:
+                self.embedder_failed = True
+                print(f"Embedding model unavailable, using local fallback vectors: {exc}")
+        return self.embedder
+
+    def _load_encoder(self, backend, quantize):
+        return load_encoder(
+            EMBEDDER_NAME,
+            backend=backend,
+            quantize=quantize,
+            threads=EMBEDDING_THREADS,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            export_dir=EMBEDDING_ONNX_DIR,
+        )
+
+    def _check_parity(self, encoder):
+        """
+        Before an index embedded by one backend is queried with another,
+        compare both on probe texts, and return the encoder to query with.
+        Below EMBEDDING_PARITY_MIN_COSINE the index is flagged for a rebuild
+        and queries keep using the index's own backend until it runs; if
+        that one cannot load either, semantic search is off until then.
+        """
+        index_backend = self.index_backend
+        if index_backend in (None, FALLBACK_MODEL_NAME, encoder.backend) or not any(self.counts().values()):
+            return encoder
+        backend, _, quantize = index_backend.partition("-")
+        reference = None
         try:
-            from sentence_transformers import SentenceTransformer
-            self.embedder = SentenceTransformer(EMBEDDER_NAME)
+            reference = self._load_encoder(backend, quantize or "none")
+            self.parity = parity(encoder, reference)
+            self.parity["ok"] = self.parity["min_cosine"] >= EMBEDDING_PARITY_MIN_COSINE
         except Exception as exc:
-            self.embedder_failed = True
-            print(f"Embedding model unavailable, using local fallback vectors: {exc}")
-        return self.embedder
+            self.parity = {"backend": encoder.backend, "reference": index_backend, "ok": False, "error": str(exc)}
+        print(f"Embedding backend parity: {self.parity}")
+        if self.parity["ok"]:
+            return encoder
+
+        self.needs_rebuild = True
+        self.rebuild_embedder = encoder
+        print(f"Index was embedded with {index_backend}; rebuild it with {encoder.backend}")
+        if reference is not None:
+            print(f"Querying with {index_backend} until the rebuild")
+            return reference
+        self.semantic_disabled = True
+        print("Semantic search is off until the rebuild")
+        return encoder
+
+    def semantic_search_ready(self):
+        """False while the index cannot be queried in its own vector space."""
+        self._get_embedder()
+        return not self.semantic_disabled
+
+    def warm_up(self):
+        """Load the embedding model and run one encode; returns the model name."""
+        self._get_embedder()
+        self._encode(["warm up"])
+        return self._model_name()
+
+    def _publish(self, kind, index, id_map, metadata, lexical, mapped=False, vectors=None):
+        previous = self.snapshots.get(kind)
+        version = previous.version + 1 if previous else 0
+        if vectors is None:
+            vectors = self.vectors[kind]
+        # writers append to the published snapshot's vector file
+        self.vectors[kind] = vectors
+        # a single dict item assignment, atomic for concurrent readers
+        self.snapshots[kind] = IndexSnapshot(index, id_map, metadata, lexical, version, mapped, vectors)
+
+    def _new_vector_file(self, kind):
+        """An empty vector file for a fresh label space, named after the next generation."""
+        base = KINDS[kind]["vectors"]
+        # the file in use may not exist yet after clear()
+        names = {path.name for path in base.parent.glob(f"{base.stem}.*{base.suffix}")}
+        names.add(self.vectors[kind].path.name)
+        generations = [
+            int(name[len(base.stem) + 1:-len(base.suffix)])
+            for name in names
+            if name[len(base.stem) + 1:-len(base.suffix)].isdigit()
+        ]
+        path = base.with_name(f"{base.stem}.{max(generations, default=0) + 1:06d}{base.suffix}")
+        vectors = VectorFile(path, EMBEDDING_DIM)
+        vectors.reset()
+        return vectors
+
+    def _prune_vector_files(self):
+        """Delete vector files that no kept snapshot refers to."""
+        keep = {vectors.path.name for vectors in self.vectors.values()}
+        for path in self.snapshot_dir.candidates():
+            try:
+                manifest = self.snapshot_dir.read_manifest(path)
+            except SnapshotError:
+                continue
+            for kind, info in manifest.get("kinds", {}).items():
+                keep.add(info.get("vector_file", KINDS[kind]["vectors"].name))
+        for paths in KINDS.values():
+            base = paths["vectors"]
+            for path in base.parent.glob(f"{base.stem}*{base.suffix}"):
+                if path.name not in keep:
+                    path.unlink(missing_ok=True)
 
     def _load_or_init(self):
-        with self.lock:
-            self.question_index = self._new_index()
-            self.image_index = self._new_index()
-
-            if QUESTION_INDEX_PATH.exists():
-                self.question_index = faiss.read_index(str(QUESTION_INDEX_PATH))
-            if IMAGE_INDEX_PATH.exists():
-                self.image_index = faiss.read_index(str(IMAGE_INDEX_PATH))
-
-            if QUESTION_ID_MAP_PATH.exists():
-                with open(QUESTION_ID_MAP_PATH, "rb") as f:
-                    self.question_ids = pickle.load(f)
-            if IMAGE_ID_MAP_PATH.exists():
-                with open(IMAGE_ID_MAP_PATH, "rb") as f:
-                    self.image_ids = pickle.load(f)
+        with self.write_lock:
+            for path in self.snapshot_dir.candidates():
+                try:
+                    loaded, manifest = self._read_snapshot(path)
+                except (SnapshotError, RuntimeError, OSError, pickle.UnpicklingError) as exc:
+                    print(f"Skipping index snapshot {path.name}: {exc}")
+                    continue
+                for kind, parts in loaded.items():
+                    self._publish(kind, *parts)
+                self.snapshot_name = path.name
+                self.index_backend = manifest.get("embedding_backend", "torch")
+                if manifest.get("model_name") != self._index_model_name():
+                    self.needs_rebuild = True
+                    print(
+                        f"Index snapshot {path.name} was embedded with {manifest.get('model_name')}, "
+                        f"current model is {self._index_model_name()}; rebuild the index"
+                    )
+                self._replay_journal(path)
+                if path != self.snapshot_dir.current():
+                    # a fallback snapshot: the next change commits a full one
+                    self.journal_entries = INDEX_JOURNAL_MAX_ENTRIES
+                return
+
+            self._load_legacy()
+
+    def _read_snapshot(self, path):
+        manifest = self.snapshot_dir.read_manifest(path, verify_checksums=INDEX_VERIFY_CHECKSUMS)
+        loaded = {}
+        for kind in KINDS:
+            info = manifest.get("kinds", {}).get(kind)
+            if info is None:
+                raise SnapshotError(f"manifest has no {kind} entry")
+
+            # IO_FLAG_MMAP only maps IVF inverted lists; flat codes and HNSW
+            # graphs are mapped in place by IO_FLAG_MMAP_IFC
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+            mmap = bool(FAISS_MMAP and mmap_flag) and info.get("index_type") in ("flat", "hnsw")
+            index = faiss.read_index(str(path / f"{kind}.index"), mmap_flag if mmap else 0)
+            if (path / f"{kind}_ids.npy").exists():
+                id_map = IdMap.load(path, kind, mmap=FAISS_MMAP)
+            else:
+                with open(path / f"{kind}_ids.pkl", "rb") as f:
+                    id_map = IdMap.from_state(pickle.load(f))
+            with open(path / f"{kind}_meta.pkl", "rb") as f:
+                metadata = MetadataIndex.from_state(pickle.load(f), FILTER_FIELDS[kind])
+            lexical = BM25Index(BM25_K1, BM25_B)
+            if (path / f"{kind}_bm25.pkl").exists():
+                with open(path / f"{kind}_bm25.pkl", "rb") as f:
+                    lexical = BM25Index.from_state(pickle.load(f))
+            if len(id_map) and not len(lexical):
+                print(f"Index snapshot {path.name} has no {kind} lexical index; rebuild the index")
+                self.needs_rebuild = True
+
+            self._check_snapshot(kind, info, index, id_map)
+            vectors = VectorFile(
+                KINDS[kind]["vectors"].with_name(info.get("vector_file", KINDS[kind]["vectors"].name)), EMBEDDING_DIM
+            )
+            vector_rows = info.get("vector_rows", info["next_label"])
+            if len(vectors) < vector_rows:
+                print(
+                    f"{kind} vector file holds {len(vectors)} rows, "
+                    f"snapshot {path.name} needs {vector_rows}; rebuild the index"
+                )
+                self.needs_rebuild = True
+            loaded[kind] = (index, id_map, metadata, lexical, mmap, vectors)
+        return loaded, manifest
+
+    def _check_snapshot(self, kind, info, index, id_map):
+        """Raise SnapshotError when the index and id map do not describe the same rows."""
+        if index.ntotal != info["ntotal"]:
+            raise SnapshotError(f"{kind} index holds {index.ntotal} vectors, manifest says {info['ntotal']}")
+        if len(id_map) != info["live"] or id_map.next_label != info["next_label"]:
+            raise SnapshotError(f"{kind} id map does not match the manifest")
+        if index_type_of(index) != info["index_type"]:
+            raise SnapshotError(f"{kind} index is {index_type_of(index)}, manifest says {info['index_type']}")
+
+        stored = index_labels(index)
+        if len(stored) and (stored.min() < 0 or stored.max() >= id_map.next_label):
+            raise SnapshotError(f"{kind} index has labels the id map never assigned")
+        if not np.isin(id_map.live_labels(), stored).all():
+            raise SnapshotError(f"{kind} id map has labels missing from the index")
+
+    def _load_legacy(self):
+        migrated = False
+        for kind, paths in KINDS.items():
+            index = self._new_index()
+            id_map = IdMap()
+            metadata = MetadataIndex(FILTER_FIELDS[kind])
+
+            if paths["index"].exists():
+                index = self._upgrade_legacy_index(faiss.read_index(str(paths["index"])))
+                migrated = True
+            if paths["id_map"].exists():
+                with open(paths["id_map"], "rb") as f:
+                    id_map = IdMap.from_state(pickle.load(f))
+            if paths["metadata"].exists():
+                with open(paths["metadata"], "rb") as f:
+                    metadata = MetadataIndex.from_state(pickle.load(f), FILTER_FIELDS[kind])
+
+            if index.ntotal != len(id_map) and supports_remove(index_type_of(index)):
+                print(f"Legacy {kind} index holds {index.ntotal} vectors for {len(id_map)} ids; rebuild the index")
+                self.needs_rebuild = True
+
+            # stores written before the exact vector file existed
+            if len(self.vectors[kind]) < id_map.next_label and index.ntotal:
+                self.vectors[kind].write(*export_vectors(index))
+
+            if len(id_map):
+                self.needs_rebuild = True
+            self._publish(kind, index, id_map, metadata, BM25Index(BM25_K1, BM25_B))
+
+        if migrated:
+            self.save()
 
     def save(self):
-        with self.lock:
-            faiss.write_index(self.question_index, str(QUESTION_INDEX_PATH))
-            faiss.write_index(self.image_index, str(IMAGE_INDEX_PATH))
-            with open(QUESTION_ID_MAP_PATH, "wb") as f:
-                pickle.dump(self.question_ids, f)
-            with open(IMAGE_ID_MAP_PATH, "wb") as f:
-                pickle.dump(self.image_ids, f)
+        """Commit every kind's current snapshot as one new snapshot directory."""
+        with self.write_lock:
+            snapshots = dict(self.snapshots)
+            # the vector rows a snapshot points at must be durable before it is
+            for snapshot in snapshots.values():
+                snapshot.vectors.sync()
+
+            def write(directory):
+                for kind, snapshot in snapshots.items():
+                    faiss.write_index(snapshot.index, str(directory / f"{kind}.index"))
+                    snapshot.id_map.save(directory, kind)
+                    with open(directory / f"{kind}_meta.pkl", "wb") as f:
+                        pickle.dump(snapshot.metadata.state(), f)
+                    with open(directory / f"{kind}_bm25.pkl", "wb") as f:
+                        pickle.dump(snapshot.lexical.state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            manifest = {
+                "model_name": self._index_model_name(),
+                "embedding_backend": self._backend_name(),
+                "parity": self.parity,
+                "dim": EMBEDDING_DIM,
+                "kinds": {
+                    kind: {
+                        "index_type": index_type_of(snapshot.index),
+                        "storage": storage_of(snapshot.index),
+                        "ntotal": int(snapshot.index.ntotal),
+                        "live": len(snapshot.id_map),
+                        "next_label": snapshot.id_map.next_label,
+                        "vector_file": snapshot.vectors.path.name,
+                        "vector_rows": len(snapshot.vectors),
+                    }
+                    for kind, snapshot in snapshots.items()
+                },
+            }
+            self.snapshot_name = self.snapshot_dir.write(write, manifest).name
+            self.journal_entries = 0
+            self._prune_vector_files()
+
+    def _commit(self, entry, full=False):
+        """
+        Make one incremental change durable. Normally only the entry is
+        appended to the current snapshot's journal, after the vector rows it
+        refers to are fsynced; a full snapshot is written after a retrain,
+        when there is no snapshot yet, or once the journal holds
+        INDEX_JOURNAL_MAX_ENTRIES entries.
+        """
+        if full or self.snapshot_name is None or self.journal_entries >= INDEX_JOURNAL_MAX_ENTRIES:
+            self.save()
+            return
+        for snapshot in self.snapshots.values():
+            snapshot.vectors.sync()
+        self.snapshot_dir.append_journal(self.snapshot_dir.root / self.snapshot_name, entry)
+        self.journal_entries += 1
+
+    def _replay_journal(self, path):
+        """Re-apply the changes journaled on top of a just-loaded snapshot."""
+        entries = self.snapshot_dir.read_journal(path)
+        for position, entry in enumerate(entries):
+            try:
+                self._apply(entry)
+            except (SnapshotError, ValueError, IndexError) as exc:
+                print(f"Stopped replaying the {path.name} journal at entry {position}: {exc}; rebuild the index")
+                self.needs_rebuild = True
+                # what was replayed is consistent; commit it so later
+                # entries are not appended behind the bad one
+                self.save()
+                return
+        self.journal_entries = len(entries)
+
+    def _apply(self, entry):
+        op, kind = entry[0], entry[1]
+        if op == "add":
+            _, _, ids, labels, records, texts = entry
+            vectors = self.vectors[kind]
+            labels = np.asarray(labels, dtype="int64")
+            if len(labels) and labels.max() >= len(vectors):
+                raise SnapshotError(f"{kind} vector file is missing journaled rows")
+            self._add(kind, ids, vectors.read(labels), records, texts, expected_labels=labels)
+        elif op == "remove":
+            self._remove(kind, entry[2])
+        elif op == "metadata":
+            self._update_metadata(entry[2])
+        else:
+            raise SnapshotError(f"unknown journal entry {op}")
 
     def clear(self):
-        with self.lock:
-            self.question_index = self._new_index()
-            self.image_index = self._new_index()
-            self.question_ids = []
-            self.image_ids = []
+        with self.write_lock:
+            for kind in KINDS:
+                self._publish(
+                    kind,
+                    self._new_index(),
+                    IdMap(),
+                    MetadataIndex(FILTER_FIELDS[kind]),
+                    BM25Index(BM25_K1, BM25_B),
+                    vectors=self._new_vector_file(kind),
+                )
+            self.needs_rebuild = False
             self.save()
 
+    def counts(self):
+        return {kind: len(snapshot.id_map) for kind, snapshot in self.snapshots.items()}
+
+    def index_info(self):
+        info = {}
+        for kind in KINDS:
+            snapshot = self.snapshots[kind]
+            info[kind] = {
+                "index_type": index_type_of(snapshot.index),
+                "storage": storage_of(snapshot.index),
+                "ntotal": int(snapshot.index.ntotal),
+                "live": len(snapshot.id_map),
+                "filterable": len(snapshot.metadata),
+                "lexical_docs": len(snapshot.lexical),
+                "version": snapshot.version,
+            }
+        return info
+
+    def index_version(self, kind="questions"):
+        """Version of the published snapshot; changes with every write."""
+        return self.snapshots[kind].version
+
+    def verify_snapshot(self):
+        """Full sha256 check of the loaded snapshot's files, which start-up skips by default."""
+        if self.snapshot_name is None:
+            return {"snapshot": None, "ok": True, "corrupt_files": []}
+        try:
+            corrupt = self.snapshot_dir.verify(self.snapshot_dir.root / self.snapshot_name)
+        except (SnapshotError, OSError) as exc:
+            return {"snapshot": self.snapshot_name, "ok": False, "error": str(exc)}
+        return {"snapshot": self.snapshot_name, "ok": not corrupt, "corrupt_files": corrupt}
+
+    def is_consistent(self, question_count, image_count):
+        """
+        True when the index holds exactly the DB rows, each with filter
+        metadata, embedded by the current model.
+        """
+        if self.needs_rebuild:
+            return False
+        expected = {"questions": question_count, "images": image_count}
+        return all(
+            len(self.snapshots[kind].id_map) == expected[kind]
+            and len(self.snapshots[kind].metadata) == expected[kind]
+            for kind in KINDS
+        )
+
+    def _index_model_name(self):
+        if EMBEDDING_FALLBACK_ONLY or self.embedder_failed:
+            return FALLBACK_MODEL_NAME
+        return EMBEDDER_NAME
+
+    def _backend_name(self):
+        if EMBEDDING_FALLBACK_ONLY or self.embedder_failed:
+            return FALLBACK_MODEL_NAME
+        if self.embedder is not None:
+            return self.embedder.backend
+        return backend_label(EMBEDDING_BACKEND, EMBEDDING_QUANTIZE)
+
+    def _model_name(self):
+        """Cache identity: the model plus any non-default backend."""
+        backend = self._backend_name()
+        if backend in (FALLBACK_MODEL_NAME, "torch"):
+            return self._index_model_name()
+        return f"{EMBEDDER_NAME}+{backend}"
+
     def embed_texts(self, texts):
         texts = [normalize_text(t) for t in texts]
         if not texts:
             return np.zeros((0, 384), dtype="float32")
+        if self.embedding_cache is None:
+            return self._encode(texts)
+
+        model_name = self._model_name()
+        try:
+            vectors, missing, keys = self.embedding_cache.lookup(model_name, texts)
+        except Exception as exc:
+            print(f"Embedding cache lookup failed: {exc}")
+            return self._encode(texts)
+        if not missing:
+            return vectors
+
+        computed = self._encode([texts[i] for i in missing])
+        if self._model_name() != model_name:
+            # the model failed to load while encoding; don't mix vector spaces
+            return self.embed_texts(texts)
+        vectors[missing] = computed
+        try:
+            self.embedding_cache.store([keys[i] for i in missing], computed)
+        except Exception as exc:
+            print(f"Embedding cache write failed: {exc}")
+        return vectors
+
+    def _encode(self, texts):
         embedder = self._get_embedder()
         if embedder is None:
             return self._fallback_embed_texts(texts)
-        vectors = embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=False)
-        return np.array(vectors, dtype="float32")
+        return embedder.encode(texts)
+
+    def embed_queries(self, texts):
+        """
+        Embed search queries through the in-memory LRU. Generate requests
+        repeat a small set of topic/subject strings, so hot queries skip the
+        model entirely; the misses are encoded together in one batch.
+        """
+        model_name = self._model_name()
+        keys = [(model_name, normalize_text(text)) for text in texts]
+        vectors = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embed_texts([texts[i] for i in missing])
+            cacheable = self._model_name() == model_name
+            for i, vector in zip(missing, computed):
+                vector.setflags(write=False)
+                vectors[i] = vector
+                if cacheable:
+                    self.query_cache.put(keys[i], vector)
+        return np.vstack(vectors) if vectors else np.zeros((0, EMBEDDING_DIM), dtype="float32")
+
+    def embed_query(self, text):
+        return self.embed_queries([text])
+
+    def cache_stats(self):
+        return {
+            "disk": self.embedding_cache.stats() if self.embedding_cache is not None else {"enabled": False},
+            "query": self.query_cache.stats(),
+        }
 
     def _fallback_embed_texts(self, texts):
-        vectors = []
-        for text in texts:
-            vector = np.zeros(384, dtype="float32")
-            for token in text.lower().split():
-                digest = hashlib.md5(token.encode("utf-8")).digest()
-                index = int.from_bytes(digest[:2], "little") % 384
-                sign = 1.0 if digest[2] % 2 == 0 else -1.0
-                vector[index] += sign
-            norm = np.linalg.norm(vector)
-            if norm > 0:
-                vector = vector / norm
-            vectors.append(vector)
-        return np.array(vectors, dtype="float32")
+        return self.fallback_embedder.encode(texts)
 
     def rebuild_from_db(self, session, Question, ImageAsset):
+        """
+        Full re-embed of every question and image. Ingestion keeps the index
+        current incrementally; this is the explicit admin repair path.
+        """
+        self.rebuild_from_rows(collect_rebuild_rows(session, Question, ImageAsset))
 
-        with self.lock:
-            self.question_index = self._new_index()
-            self.image_index = self._new_index()
-            self.question_ids = []
-            self.image_ids = []
-
-            questions = session.query(Question).order_by(Question.created_at.asc()).all()
-            q_texts = [q.embedding_text or q.question_text for q in questions]
-            q_vectors = self.embed_texts(q_texts)
-            if len(questions) and len(q_vectors):
-                self.question_index.add(q_vectors)
-                self.question_ids = [q.id for q in questions]
-
-            images = session.query(ImageAsset).order_by(ImageAsset.created_at.asc()).all()
-            i_texts = [(img.caption or "") + " " + (img.surrounding_text or "")[:500] for img in images]
-            i_vectors = self.embed_texts(i_texts)
-            if len(images) and len(i_vectors):
-                self.image_index.add(i_vectors)
-                self.image_ids = [img.id for img in images]
+    def rebuild_from_rows(self, rows):
+        """rows maps each kind to (ids, texts, filter records), as collected from the DB."""
+        with self.write_lock:
+            self._get_embedder()
+            if self.rebuild_embedder is not None:
+                # re-embed everything with the configured backend
+                self.embedder, self.rebuild_embedder = self.rebuild_embedder, None
+            for kind in KINDS:
+                ids, texts, records = rows[kind]
+                self._rebuild(kind, ids, self.embed_texts(texts), records, texts)
 
+            self.needs_rebuild = False
+            self.index_backend = self._backend_name()
+            self.parity = None
+            self.semantic_disabled = False
             self.save()
 
-    def add_questions(self, question_records):
-        texts = [q.get("embedding_text") or q.get("question_text") or q.get("question") for q in question_records]
+    def _rebuild(self, kind, ids, vectors, records, texts):
+        # compact into a fresh label space and a new vector file, dropping
+        # the tombstones of removed and re-ingested rows; older snapshots
+        # keep reading the file their labels point into
+        id_map = IdMap()
+        labels = id_map.assign(ids)
+        metadata = MetadataIndex(FILTER_FIELDS[kind])
+        metadata.add(labels, records)
+        lexical = BM25Index(BM25_K1, BM25_B)
+        lexical.add(labels, texts)
+        vector_file = self._new_vector_file(kind)
+        vector_file.write(labels, vectors)
+        self._publish(kind, self._build_index(labels, vectors), id_map, metadata, lexical, vectors=vector_file)
+
+    def _maybe_retrain(self, kind, index, id_map):
+        """
+        Retrain when the corpus outgrows a flat index, or when an HNSW graph
+        has accumulated too many tombstones from removals.
+        """
+        index_type = choose_index_type(len(id_map))
+        storage = choose_storage(len(id_map), index_type)
+        tombstones = index.ntotal - len(id_map)
+        if not is_upgrade(index, index_type, storage) and tombstones <= 0.1 * index.ntotal:
+            return index
+        labels = id_map.live_labels()
+        return self._build_index(labels, self.vectors[kind].read(labels))
+
+    def _copy_snapshot(self, kind):
+        snapshot = self.snapshots[kind]
+        # a clone of a mapped index still views the file and aborts on add,
+        # so writers get an owned copy through a serialize round trip
+        if snapshot.mapped:
+            index = faiss.deserialize_index(faiss.serialize_index(snapshot.index))
+        else:
+            index = faiss.clone_index(snapshot.index)
+        return (
+            index,
+            snapshot.id_map.copy(),
+            snapshot.metadata.copy(),
+            snapshot.lexical.copy(),
+        )
+
+    def _drop_labels(self, index, id_map, metadata, lexical, ids):
+        labels = id_map.discard(ids)
+        metadata.discard(labels)
+        lexical.discard(labels)
+        if len(labels) and supports_remove(index_type_of(index)):
+            index.remove_ids(labels)
+        return len(labels)
+
+    def _add(self, kind, ids, vectors, records, texts, expected_labels=None):
+        """
+        Returns (labels, retrained). A journal replay passes the labels the
+        entry was given; its vector rows are already on disk.
+        """
+        # copy-on-write: readers keep searching the published snapshot
+        index, id_map, metadata, lexical = self._copy_snapshot(kind)
+        self._drop_labels(index, id_map, metadata, lexical, [i for i in ids if i in id_map])
+        labels = id_map.assign(ids)
+        if expected_labels is None:
+            self.vectors[kind].write(labels, vectors)
+        elif not np.array_equal(labels, expected_labels):
+            raise SnapshotError(f"{kind} journal labels do not match the id map")
+        metadata.add(labels, records)
+        lexical.add(labels, texts)
+        index.add_with_ids(vectors, labels)
+        published = self._maybe_retrain(kind, index, id_map)
+        self._publish(kind, published, id_map, metadata, lexical)
+        return labels, published is not index
+
+    def _remove(self, kind, ids):
+        """Returns (removed count, retrained)."""
+        if not any(db_id in self.snapshots[kind].id_map for db_id in ids):
+            return 0, False
+        index, id_map, metadata, lexical = self._copy_snapshot(kind)
+        removed = self._drop_labels(index, id_map, metadata, lexical, ids)
+        published = self._maybe_retrain(kind, index, id_map)
+        self._publish(kind, published, id_map, metadata, lexical)
+        return removed, published is not index
+
+    def add_questions(self, question_records, vectors=None):
+        """vectors, if given, are embed_texts of the records' texts computed by the caller."""
+        texts = [question_embedding_text(q) for q in question_records]
         ids = [q["id"] for q in question_records]
-        vectors = self.embed_texts(texts)
-        with self.lock:
+        vectors = self.embed_texts(texts) if vectors is None else np.asarray(vectors, dtype="float32")
+        with self.write_lock:
             if len(vectors):
-                self.question_index.add(vectors)
-                self.question_ids.extend(ids)
-                self.save()
+                records = [_question_metadata(q) for q in question_records]
+                labels, retrained = self._add("questions", ids, vectors, records, texts)
+                self._commit(("add", "questions", ids, labels.tolist(), records, texts), full=retrained)
 
     def add_images(self, image_records):
-        texts = [(img.get("caption", "") + " " + (img.get("surrounding_text", "")[:500])) for img in image_records]
+        texts = [((img.get("caption") or "") + " " + ((img.get("surrounding_text") or "")[:500])) for img in image_records]
         ids = [img["id"] for img in image_records]
         vectors = self.embed_texts(texts)
-        with self.lock:
+        with self.write_lock:
             if len(vectors):
-                self.image_index.add(vectors)
-                self.image_ids.extend(ids)
-                self.save()
+                records = [_image_metadata(img) for img in image_records]
+                labels, retrained = self._add("images", ids, vectors, records, texts)
+                self._commit(("add", "images", ids, labels.tolist(), records, texts), full=retrained)
+
+    def update_question_metadata(self, updates):
+        """
+        Change filter metadata (e.g. topic) of indexed questions without
+        touching their vectors; updates maps question id to changed fields.
+        """
+        with self.write_lock:
+            updated = self._update_metadata(updates)
+            if updated:
+                self._commit(("metadata", "questions", updates))
+            return updated
+
+    def _update_metadata(self, updates):
+        snapshot = self.snapshots["questions"]
+        metadata = snapshot.metadata.copy()
+        labels, records = [], []
+        for db_id, fields in updates.items():
+            label = snapshot.id_map.label_of(db_id)
+            if label is None or label not in metadata.values:
+                continue
+            record = dict(zip(metadata.fields, metadata.values[label]))
+            record.update(fields)
+            labels.append(label)
+            records.append(record)
+        if not labels:
+            return 0
+        metadata.add(labels, records)
+        self._publish(
+            "questions", snapshot.index, snapshot.id_map, metadata, snapshot.lexical, snapshot.mapped, snapshot.vectors
+        )
+        return len(labels)
 
-    def search_questions(self, query, k=10):
-        with self.lock:
-            if self.question_index.ntotal == 0 or not self.question_ids:
-                return []
-            q_vec = self.embed_texts([query])
-            if q_vec.size == 0:
-                return []
-            k = min(k, len(self.question_ids))
-            distances, indices = self.question_index.search(q_vec, k)
+    def remove_questions(self, question_ids):
+        with self.write_lock:
+            removed, retrained = self._remove("questions", question_ids)
+            if removed:
+                self._commit(("remove", "questions", list(question_ids)), full=retrained)
+            return removed
+
+    def remove_images(self, image_ids):
+        with self.write_lock:
+            removed, retrained = self._remove("images", image_ids)
+            if removed:
+                self._commit(("remove", "images", list(image_ids)), full=retrained)
+            return removed
+
+    def _filter_mask(self, kind, snapshot, filters):
+        if not filters:
+            return None
+        if len(snapshot.metadata) < len(snapshot.id_map):
+            print(f"FAISS {kind} metadata incomplete, searching without filters")
+            return None
+        return snapshot.metadata.mask(filters, snapshot.id_map.next_label)
+
+    def _lexical_search(self, kind, queries, k, filters=None):
+        """BM25 top-k per query, with the same filters as the vector search."""
+        snapshot = self.snapshots[kind]
+        if not queries or not len(snapshot.lexical):
+            return [[] for _ in queries]
+        mask = self._filter_mask(kind, snapshot, filters)
+        batch = []
+        for query in queries:
+            labels, scores = snapshot.lexical.search(query or "", k, mask=mask)
             results = []
-            for dist, idx in zip(distances[0], indices[0]):
-                if idx < 0 or idx >= len(self.question_ids):
-                    continue
-                results.append({
-                    "id": self.question_ids[idx],
-                    "distance": float(dist),
-                })
-            return results
-
-    def search_images(self, query, k=5):
-        with self.lock:
-            if self.image_index.ntotal == 0 or not self.image_ids:
-                return []
-            q_vec = self.embed_texts([query])
-            if q_vec.size == 0:
-                return []
-            k = min(k, len(self.image_ids))
-            distances, indices = self.image_index.search(q_vec, k)
+            for label, score in zip(labels, scores):
+                db_id = snapshot.id_map.get(label)
+                if db_id is not None:
+                    results.append({"id": db_id, "score": float(score)})
+            batch.append(results)
+        return batch
+
+    def _search(self, kind, queries, k, filters=None, nprobe=None, ef_search=None, rerank=None):
+        """
+        Search a batch of queries with one embed call and one index.search.
+        Runs without any lock against the snapshot published at call time.
+        """
+        snapshot = self.snapshots[kind]
+        if not queries or snapshot.index.ntotal == 0 or not snapshot.id_map:
+            return [[] for _ in queries]
+        q_vecs = self.embed_queries(queries)
+
+        index = snapshot.index
+        id_map = snapshot.id_map
+        mask = self._filter_mask(kind, snapshot, filters)
+
+        sel = bitmap = None
+        selectivity = 1.0
+        limit = index.ntotal
+        if mask is not None:
+            matches = int(mask.sum())
+            if matches == 0:
+                return [[] for _ in queries]
+            # the mask only covers live labels, so no tombstone over-fetch
+            k = fetch = min(k, matches)
+            sel, bitmap = bitmap_selector(mask)
+            selectivity = matches / len(id_map)
+            limit = matches
+        else:
+            k = min(k, len(id_map))
+            # over-fetch past HNSW tombstones so callers still get k live rows
+            fetch = min(index.ntotal, k + index.ntotal - len(id_map))
+
+        if rerank is None:
+            rerank = storage_of(index) != "float32" and FAISS_RERANK_FACTOR > 1
+        if rerank:
+            fetch = min(fetch * max(FAISS_RERANK_FACTOR, 1), limit)
+
+        params = search_params(
+            index, fetch, nprobe=nprobe, ef_search=ef_search, sel=sel, selectivity=selectivity
+        )
+        all_distances, all_labels = index.search(q_vecs, fetch, params=params)
+
+        batch = []
+        for q_vec, distances, labels in zip(q_vecs, all_distances, all_labels):
+            if rerank:
+                # exact L2 against the float32 rows on disk
+                labels = labels[labels >= 0]
+                distances = ((snapshot.vectors.read(labels) - q_vec) ** 2).sum(axis=1)
+                order = np.argsort(distances, kind="stable")
+                distances, labels = distances[order], labels[order]
+
             results = []
-            for dist, idx in zip(distances[0], indices[0]):
-                if idx < 0 or idx >= len(self.image_ids):
+            for dist, label in zip(distances, labels):
+                db_id = id_map.get(label) if label >= 0 else None
+                if db_id is None:
                     continue
                 results.append({
-                    "id": self.image_ids[idx],
+                    "id": db_id,
                     "distance": float(dist),
                 })
-            return results
+                if len(results) >= k:
+                    break
+            batch.append(results)
+        return batch
+
+    def search_questions(self, query, k=10, filters=None, nprobe=None, ef_search=None, rerank=None):
+        """
+        filters may contain subject, difficulty, topic and source_pdf; each
+        takes a value or a list of accepted values and is applied inside
+        the FAISS search. rerank defaults to on for compressed storage.
+        """
+        return self._search("questions", [query], k, filters=filters, nprobe=nprobe, ef_search=ef_search, rerank=rerank)[0]
+
+    def question_vectors(self, ids):
+        """Exact stored vectors of question ids, zeros for ids not indexed."""
+        snapshot = self.snapshots["questions"]
+        labels = [snapshot.id_map.label_of(db_id) for db_id in ids]
+        found = [pos for pos, label in enumerate(labels) if label is not None]
+        vectors = np.zeros((len(ids), EMBEDDING_DIM), dtype="float32")
+        if found:
+            vectors[found] = snapshot.vectors.read([labels[pos] for pos in found])
+        return vectors
+
+    def filter_values(self, kind, field):
+        """Distinct values of a filter field in the published snapshot, lowercased."""
+        return self.snapshots[kind].metadata.field_values(field)
+
+    def search_questions_lexical(self, query, k=10, filters=None):
+        """BM25 keyword search over question embedding text; results carry "score"."""
+        return self._lexical_search("questions", [query], k, filters=filters)[0]
+
+    def search_questions_lexical_batch(self, queries, k=10, filters=None):
+        return self._lexical_search("questions", list(queries), k, filters=filters)
+
+    def search_images(self, query, k=5, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._search("images", [query], k, filters=filters, nprobe=nprobe, ef_search=ef_search, rerank=rerank)[0]
+
+    def search_questions_batch(self, queries, k=10, filters=None, nprobe=None, ef_search=None, rerank=None):
+        """One result list per query, in order; filters apply to every query."""
+        return self._search("questions", list(queries), k, filters=filters, nprobe=nprobe, ef_search=ef_search, rerank=rerank)
+
+    def search_images_batch(self, queries, k=5, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._search("images", list(queries), k, filters=filters, nprobe=nprobe, ef_search=ef_search, rerank=rerank)
+
+    def storage_report(self, kind="questions", k=10, n_queries=200):
+        """Memory per vector and recall@k of each storage option on this corpus."""
+        snapshot = self.snapshots[kind]
+        labels = snapshot.id_map.live_labels()
+        report = storage_report(snapshot.vectors.read(labels), k=k, n_queries=n_queries)
+        report["kind"] = kind
+        report["current_storage"] = storage_of(snapshot.index)
+        return report
 
 _faiss_store = None
+_faiss_store_lock = threading.Lock()
 
 def get_faiss_store():
     global _faiss_store
 
     if _faiss_store is None:
-        print("Initializing FAISS Store...")
-        _faiss_store = FaissStore()
+        # the warm-up thread and early requests may race to create it
+        with _faiss_store_lock:
+            if _faiss_store is None and VECTOR_SERVICE_ADDRESS:
+                from rag.vector_service import VectorServiceClient
+                print(f"Using vector service at {VECTOR_SERVICE_ADDRESS}")
+                _faiss_store = VectorServiceClient(VECTOR_SERVICE_ADDRESS)
+            elif _faiss_store is None:
+                print("Initializing FAISS Store...")
+                _faiss_store = FaissStore()
 
     return _faiss_store
\ No newline at end of file
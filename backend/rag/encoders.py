@@ -0,0 +1,185 @@
+import numpy as np
+
+print("LOADING encoders")
+
+BACKENDS = ("torch", "onnx")
+QUANTIZATIONS = ("none", "int8")
+
+# short JEE-style probes for comparing two backends of the same model
+PARITY_TEXTS = [
+    "A block of mass 2 kg slides down a frictionless incline of angle 30 degrees.",
+    "Find the equivalent resistance of three 6 ohm resistors connected in parallel.",
+    "A convex lens of focal length 20 cm forms a real image twice the size of the object.",
+    "The de Broglie wavelength of an electron accelerated through 100 V is",
+    "Calculate the work done in an isothermal reversible expansion of an ideal gas.",
+    "Which of the following compounds shows geometrical isomerism?",
+    "The pH of a 0.01 M solution of hydrochloric acid is",
+    "Identify the major product when propene reacts with HBr in the presence of peroxide.",
+    "The hybridisation of the central atom in sulphur hexafluoride is",
+    "Evaluate the integral of x squared times e to the power x from 0 to 1.",
+    "If the roots of the quadratic equation are real and equal, find the value of k.",
+    "The number of ways of arranging the letters of the word MATHEMATICS is",
+    "Find the equation of the tangent to the parabola y squared equals 8x at (2, 4).",
+    "The probability that at least one of two independent events occurs is",
+    "Determinant of a 3 by 3 skew symmetric matrix",
+    "magnetic field at the centre of a circular current loop",
+]
+
+def backend_label(backend, quantize):
+    """Identity of an encoder configuration, e.g. "torch" or "onnx-int8"."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown embedding quantization: {quantize}")
+    return backend if quantize == "none" else f"{backend}-{quantize}"
+
+class TorchEncoder:
+    """SentenceTransformer on PyTorch, optionally with dynamic int8 Linear layers."""
+
+    def __init__(self, model_name, threads=0, batch_size=32, quantize="none"):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        if quantize == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.batch_size = batch_size
+        self.backend = backend_label("torch", quantize)
+
+    def encode(self, texts):
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=False,
+        )
+        return np.array(vectors, dtype="float32")
+
+class OnnxEncoder:
+    """
+    The same model exported to ONNX and run with ONNX Runtime. The export
+    (and the int8 dynamic quantization of it) is done once with PyTorch and
+    cached in export_dir; encoding then runs on ONNX Runtime only. Pooling
+    and normalization follow the SentenceTransformer modules so vectors
+    match the PyTorch backend.
+    """
+
+    def __init__(self, model_name, export_dir, threads=0, batch_size=32, quantize="none"):
+        import onnxruntime
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize, Pooling
+
+        reference = SentenceTransformer(model_name, device="cpu")
+        transformer = reference[0]
+        self.tokenizer = transformer.tokenizer
+        self.max_length = transformer.max_seq_length
+        pooling = next(module for module in reference if isinstance(module, Pooling))
+        self.pooling = pooling.get_pooling_mode_str()
+        if self.pooling not in ("mean", "cls"):
+            raise ValueError(f"ONNX backend does not support {self.pooling} pooling")
+        self.normalize = any(isinstance(module, Normalize) for module in reference)
+        self.dim = reference.get_sentence_embedding_dimension()
+
+        path = self._export(reference, model_name, export_dir, quantize)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.batch_size = batch_size
+        self.backend = backend_label("onnx", quantize)
+
+    @staticmethod
+    def _export(reference, model_name, export_dir, quantize):
+        import torch
+
+        export_dir.mkdir(parents=True, exist_ok=True)
+        stem = model_name.replace("/", "__")
+        fp32_path = export_dir / f"{stem}.onnx"
+        if not fp32_path.exists():
+            class LastHiddenState(torch.nn.Module):
+                def __init__(self, model):
+                    super().__init__()
+                    self.model = model
+
+                def forward(self, input_ids, attention_mask, token_type_ids):
+                    return self.model(
+                        input_ids=input_ids,
+                        attention_mask=attention_mask,
+                        token_type_ids=token_type_ids,
+                    ).last_hidden_state
+
+            sample = reference[0].tokenizer(["warm up"], return_tensors="pt", return_token_type_ids=True)
+            names = ["input_ids", "attention_mask", "token_type_ids"]
+            axes = {name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]}
+            tmp_path = fp32_path.with_suffix(".tmp")
+            torch.onnx.export(
+                LastHiddenState(reference[0].auto_model).eval(),
+                tuple(sample[name] for name in names),
+                str(tmp_path),
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=axes,
+                opset_version=14,
+            )
+            tmp_path.replace(fp32_path)
+        if quantize == "none":
+            return fp32_path
+
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = export_dir / f"{stem}.int8.onnx"
+        if not int8_path.exists():
+            tmp_path = int8_path.with_suffix(".tmp")
+            quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+            tmp_path.replace(int8_path)
+        return int8_path
+
+    def encode(self, texts):
+        out = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                list(texts[start:start + self.batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+                return_token_type_ids=True,
+            )
+            feeds = {name: batch[name].astype("int64") for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            if self.pooling == "cls":
+                vectors = hidden[:, 0]
+            else:
+                mask = batch["attention_mask"][..., None].astype("float32")
+                vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+            out.append(vectors.astype("float32"))
+        if not out:
+            return np.zeros((0, self.dim), dtype="float32")
+        return np.vstack(out)
+
+def load_encoder(model_name, backend="torch", quantize="none", threads=0, batch_size=32, export_dir=None):
+    backend_label(backend, quantize)
+    if backend == "onnx":
+        return OnnxEncoder(model_name, export_dir, threads=threads, batch_size=batch_size, quantize=quantize)
+    return TorchEncoder(model_name, threads=threads, batch_size=batch_size, quantize=quantize)
+
+def parity(encoder, reference, texts=PARITY_TEXTS):
+    """Cosine agreement between two encoders over the same texts."""
+    a = encoder.encode(texts)
+    b = reference.encode(texts)
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    cosines = (a * b).sum(axis=1)
+    return {
+        "backend": encoder.backend,
+        "reference": reference.backend,
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+    }
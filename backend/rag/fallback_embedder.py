@@ -0,0 +1,83 @@
+import hashlib
+import threading
+
+import numpy as np
+
+class HashingEmbedder:
+    """
+    Signed feature-hashing embedder used when the sentence model is not
+    available. Each lowercased whitespace token adds +-1 to one of dim
+    buckets chosen by its md5 digest, and rows are L2-normalized.
+
+    encode() produces exactly the vectors of reference_encode() (counts are
+    small integers, so float32 accumulation order does not matter) but
+    hashes each distinct token once, caches the (bucket, sign) pairs across
+    calls and sums a whole batch with one np.bincount.
+    """
+
+    def __init__(self, dim=384, max_vocab=200000):
+        self.dim = dim
+        self.max_vocab = max_vocab
+        self.lock = threading.Lock()
+        self._reset_vocab()
+
+    def _reset_vocab(self):
+        # token -> position in the feature arrays
+        self.vocab = {}
+        self.buckets = np.zeros(0, dtype="int64")
+        self.signs = np.zeros(0, dtype="float32")
+
+    def _learn(self, tokens):
+        buckets = []
+        signs = []
+        for token in tokens:
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            buckets.append(int.from_bytes(digest[:2], "little") % self.dim)
+            signs.append(1.0 if digest[2] % 2 == 0 else -1.0)
+            self.vocab[token] = len(self.vocab)
+        self.buckets = np.concatenate([self.buckets, np.array(buckets, dtype="int64")])
+        self.signs = np.concatenate([self.signs, np.array(signs, dtype="float32")])
+
+    def encode(self, texts):
+        tokens = []
+        lengths = []
+        for text in texts:
+            split = text.lower().split()
+            tokens.extend(split)
+            lengths.append(len(split))
+
+        with self.lock:
+            positions = list(map(self.vocab.get, tokens))
+            if None in positions:
+                unseen = list(dict.fromkeys(t for t, p in zip(tokens, positions) if p is None))
+                if len(self.vocab) + len(unseen) > self.max_vocab:
+                    self._reset_vocab()
+                    unseen = list(dict.fromkeys(tokens))
+                self._learn(unseen)
+                positions = list(map(self.vocab.get, tokens))
+            buckets = self.buckets[positions]
+            signs = self.signs[positions]
+
+        rows = np.repeat(np.arange(len(texts), dtype="int64"), lengths)
+        cells = rows * self.dim + buckets
+        counts = np.bincount(cells, weights=signs, minlength=len(texts) * self.dim)
+        vectors = counts.astype("float32").reshape(len(texts), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def reference_encode(self, texts):
+        """The original per-token loop, kept for parity checks and benchmarks."""
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype="float32")
+            for token in text.lower().split():
+                digest = hashlib.md5(token.encode("utf-8")).digest()
+                index = int.from_bytes(digest[:2], "little") % self.dim
+                sign = 1.0 if digest[2] % 2 == 0 else -1.0
+                vector[index] += sign
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector = vector / norm
+            vectors.append(vector)
+        return np.array(vectors, dtype="float32").reshape(len(texts), self.dim)
@@ -0,0 +1,100 @@
+import faiss
+import numpy as np
+
+FILTER_FIELDS = {
+    "questions": ("subject", "difficulty", "topic", "source_pdf"),
+    "images": ("subject", "source_pdf"),
+}
+
+def _key(value):
+    # missing values get their own posting, so a filter can ask for them
+    return None if value is None else str(value).strip().lower()
+
+class MetadataIndex:
+    """
+    Inverted postings from metadata values to FAISS labels. Used to build an
+    ID selector so filtering happens inside the FAISS search instead of
+    over-fetching and dropping rows afterwards.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.values = {}
+        self.postings = {field: {} for field in self.fields}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, labels, records):
+        for label, record in zip(labels, records):
+            label = int(label)
+            self.discard([label])
+            values = tuple(record.get(field) for field in self.fields)
+            self.values[label] = values
+            for field, value in zip(self.fields, values):
+                self.postings[field].setdefault(_key(value), set()).add(label)
+
+    def discard(self, labels):
+        for label in labels:
+            values = self.values.pop(int(label), None)
+            if values is None:
+                continue
+            for field, value in zip(self.fields, values):
+                bucket = self.postings[field].get(_key(value))
+                if bucket is not None:
+                    bucket.discard(int(label))
+                    if not bucket:
+                        del self.postings[field][_key(value)]
+
+    def mask(self, filters, size):
+        """
+        Boolean mask over labels [0, size) matching every filter. A filter
+        value may be a single value or a list of accepted values; None in a
+        list accepts labels without a value. Returns None when no filter
+        applies.
+        """
+        mask = None
+        for field, wanted in (filters or {}).items():
+            if field not in self.postings or wanted in (None, "", "All"):
+                continue
+            if not isinstance(wanted, (list, tuple, set)):
+                wanted = [wanted]
+            field_mask = np.zeros(size, dtype=bool)
+            for value in wanted:
+                labels = self.postings[field].get(_key(value))
+                if labels:
+                    field_mask[np.fromiter(labels, dtype="int64", count=len(labels))] = True
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+    def field_values(self, field):
+        """Distinct lowercased values of a field, without the missing one."""
+        return sorted(value for value in self.postings[field] if value is not None)
+
+    def copy(self):
+        other = MetadataIndex(self.fields)
+        other.values = dict(self.values)
+        other.postings = {
+            field: {value: set(labels) for value, labels in postings.items()}
+            for field, postings in self.postings.items()
+        }
+        return other
+
+    def state(self):
+        return {"fields": self.fields, "values": self.values}
+
+    @classmethod
+    def from_state(cls, state, fields):
+        index = cls(fields)
+        if state and tuple(state.get("fields", ())) == index.fields:
+            for label, values in state.get("values", {}).items():
+                index.add([label], [dict(zip(index.fields, values))])
+        return index
+
+def bitmap_selector(mask):
+    """
+    Return (selector, bitmap) for a label mask. The bitmap must stay
+    referenced for as long as the selector is used.
+    """
+    bitmap = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(bitmap), bitmap
@@ -2,6 +2,8 @@
 import json
 import re
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
 
 print("LOADING generation")
@@ -9,7 +11,7 @@ print("LOADING generation")
 import requests
 from sklearn.metrics.pairwise import cosine_similarity
 
-from config import GROQ_API_KEY, GROQ_API_URL, GROQ_MODEL, MIN_QUESTION_SIMILARITY
+from config import GROQ_API_KEY, GROQ_API_URL, GROQ_MODEL, MCQ_GENERATION_WORKERS, MIN_QUESTION_SIMILARITY
 from rag.validation import (
     normalize_text,
     is_valid_question_text,
@@ -261,3 +263,36 @@ Return exactly this JSON shape:
     except Exception as e:
         print("Error generating MCQ:", str(e))
         return None
+
+# one pool for the whole process, so MCQ_GENERATION_WORKERS caps the Groq
+# calls of all requests together rather than of each request
+_mcq_executor = ThreadPoolExecutor(max_workers=max(MCQ_GENERATION_WORKERS, 1), thread_name_prefix="mcq")
+
+def generate_mcqs(items, wanted, workers=MCQ_GENERATION_WORKERS):
+    """
+    generate_enhanced_mcq over a stream of (item, question_record) pairs on
+    the shared MCQ pool, yielding (item, mcq) in the order of items.
+    items is consumed in the calling thread, so a stream hydrated from the
+    caller's session stays there; records must be plain data. No more
+    calls are queued than `workers` or wanted() (results the caller still
+    needs) allows. Closing the generator cancels calls not started yet.
+    """
+    workers = max(int(workers), 1)
+    items = iter(items)
+    pending = deque()
+    executor = _mcq_executor
+    try:
+        while True:
+            while len(pending) < min(workers, wanted()):
+                pair = next(items, None)
+                if pair is None:
+                    break
+                item, record = pair
+                pending.append((item, executor.submit(generate_enhanced_mcq, record)))
+            if not pending:
+                return
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
@@ -0,0 +1,176 @@
+import zlib
+
+import numpy as np
+
+ID_WIDTH = 36  # uuid4 strings, matching the String(36) primary keys
+
+EMPTY = 0
+DELETED = -1
+
+def _encode(db_id):
+    return str(db_id).encode("utf-8")
+
+def _slot(key, mask):
+    return zlib.crc32(key) & mask
+
+class IdMap:
+    """
+    Stable integer labels for FAISS rows, keyed by the DB primary key.
+    Labels are handed out once and never reused, so removed rows cannot
+    be confused with rows added later.
+
+    keys is a fixed-width bytes array indexed by label (b"" once removed),
+    so label -> id is one array read. table is an open-addressing hash
+    table (linear probing, crc32 of the key) holding label + 1, with 0 for
+    empty slots and -1 for deleted ones, so id -> label is O(1) as well.
+    Both arrays are saved as .npy files and can be loaded memory-mapped;
+    a loaded map is read-only until copy() is called.
+    """
+
+    def __init__(self, keys=None, table=None):
+        self.keys = np.zeros(0, dtype=f"S{ID_WIDTH}") if keys is None else keys
+        self.next_label = len(self.keys)
+        if table is None:
+            self.table = np.zeros(8, dtype="int64")
+            self.live = 0
+            self.used = 0
+            self._rehash(np.flatnonzero(self.keys != b""), 0)
+        else:
+            self.table = table
+            self.live = int(np.count_nonzero(self.keys != b""))
+            self.used = int(np.count_nonzero(table))
+
+    def __len__(self):
+        return self.live
+
+    def __contains__(self, db_id):
+        return self.label_of(db_id) is not None
+
+    def get(self, label):
+        label = int(label)
+        if label < 0 or label >= self.next_label:
+            return None
+        key = self.keys[label]
+        return key.decode("utf-8") if key else None
+
+    def _find(self, key):
+        """Return (slot, label) for key, or (first free slot, None)."""
+        table = self.table
+        mask = len(table) - 1
+        slot = _slot(key, mask)
+        free = None
+        while True:
+            entry = int(table[slot])
+            if entry == EMPTY:
+                return (slot if free is None else free), None
+            if entry == DELETED:
+                if free is None:
+                    free = slot
+            elif self.keys[entry - 1] == key:
+                return slot, entry - 1
+            slot = (slot + 1) & mask
+
+    def label_of(self, db_id):
+        return self._find(_encode(db_id))[1]
+
+    def labels_of(self, db_ids):
+        return np.array([self.label_of(db_id) for db_id in db_ids], dtype="int64")
+
+    def live_labels(self):
+        return np.flatnonzero(self.keys[:self.next_label] != b"").astype("int64")
+
+    def db_ids(self):
+        return [key.decode("utf-8") for key in self.keys[:self.next_label] if key]
+
+    def _rehash(self, labels, extra):
+        size = 8
+        while size < 2 * (len(labels) + extra):
+            size *= 2
+        table = np.zeros(size, dtype="int64")
+        mask = size - 1
+        for label in labels:
+            slot = _slot(self.keys[label], mask)
+            while table[slot] != EMPTY:
+                slot = (slot + 1) & mask
+            table[slot] = label + 1
+        self.table = table
+        self.live = len(labels)
+        self.used = len(labels)
+
+    def _reserve(self, extra, width):
+        needed = self.next_label + extra
+        if width > self.keys.dtype.itemsize:
+            self.keys = self.keys.astype(f"S{width}")
+        if needed > len(self.keys):
+            keys = np.zeros(max(needed, 2 * len(self.keys)), dtype=self.keys.dtype)
+            keys[:self.next_label] = self.keys[:self.next_label]
+            self.keys = keys
+        # keep the table at most half full, counting deleted slots
+        if 2 * (self.used + extra) > len(self.table):
+            self._rehash(self.live_labels(), extra)
+
+    def assign(self, db_ids):
+        keys = [_encode(db_id) for db_id in db_ids]
+        if not keys:
+            return np.zeros(0, dtype="int64")
+        self._reserve(len(keys), max(len(key) for key in keys))
+        labels = np.arange(self.next_label, self.next_label + len(keys), dtype="int64")
+        for label, key in zip(labels, keys):
+            slot, existing = self._find(key)
+            if existing is not None:
+                raise ValueError(f"id {key.decode('utf-8')} already has label {existing}")
+            if self.table[slot] == EMPTY:
+                self.used += 1
+            self.keys[label] = key
+            self.table[slot] = label + 1
+            self.next_label += 1
+            self.live += 1
+        return labels
+
+    def discard(self, db_ids):
+        labels = []
+        for db_id in db_ids:
+            slot, label = self._find(_encode(db_id))
+            if label is None:
+                continue
+            self.table[slot] = DELETED
+            self.keys[label] = b""
+            self.live -= 1
+            labels.append(label)
+        return np.array(labels, dtype="int64")
+
+    def copy(self):
+        other = IdMap.__new__(IdMap)
+        other.keys = np.array(self.keys[:self.next_label])
+        other.table = np.array(self.table)
+        other.next_label = self.next_label
+        other.live = self.live
+        other.used = self.used
+        return other
+
+    def save(self, directory, prefix):
+        np.save(directory / f"{prefix}_ids.npy", np.ascontiguousarray(self.keys[:self.next_label]))
+        np.save(directory / f"{prefix}_ids_table.npy", self.table)
+
+    @classmethod
+    def load(cls, directory, prefix, mmap=True):
+        mode = "r" if mmap else None
+        keys = np.load(directory / f"{prefix}_ids.npy", mmap_mode=mode)
+        table = np.load(directory / f"{prefix}_ids_table.npy", mmap_mode=mode)
+        if len(table) & (len(table) - 1):
+            raise ValueError("id table size is not a power of two")
+        return cls(keys, table)
+
+    @classmethod
+    def from_state(cls, state):
+        """Build from the pickled dict / list formats used by older stores."""
+        if isinstance(state, list):
+            # legacy format: list position is the row in a plain flat index
+            state = {"ids": dict(enumerate(state)), "next_label": len(state)}
+        ids = state.get("ids", {})
+        next_label = int(state.get("next_label", len(ids)))
+        width = max([ID_WIDTH] + [len(_encode(db_id)) for db_id in ids.values()])
+        keys = np.zeros(next_label, dtype=f"S{width}")
+        for label, db_id in ids.items():
+            keys[int(label)] = _encode(db_id)
+        return cls(keys)
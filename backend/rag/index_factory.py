@@ -0,0 +1,245 @@
+import math
+import time
+
+import faiss
+import numpy as np
+
+from config import (
+    FAISS_INDEX_TYPE,
+    FAISS_ANN_TYPE,
+    FAISS_ANN_THRESHOLD,
+    FAISS_STORAGE,
+    FAISS_RERANK_FACTOR,
+    FAISS_NLIST,
+    FAISS_PQ_M,
+    FAISS_HNSW_M,
+    FAISS_NPROBE,
+    FAISS_EF_SEARCH,
+)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGE_TYPES = ("float32", "fp16", "sq8", "pq")
+
+# below these sizes k-means / PQ codebook training is not meaningful
+MIN_TRAIN_VECTORS = {
+    "flat": 0,
+    "ivf_flat": 39 * 32,
+    "ivf_pq": 39 * 256,
+    "hnsw": 0,
+}
+STORAGE_MIN_TRAIN = {
+    "float32": 0,
+    "fp16": 0,
+    "sq8": 256,
+    "pq": 39 * 256,
+}
+
+MAX_EF_SEARCH = 4096
+
+def choose_index_type(n_vectors):
+    """
+    Pick the index type for a corpus of n_vectors. In "auto" mode the store
+    stays on an exact flat scan until FAISS_ANN_THRESHOLD and then switches
+    to FAISS_ANN_TYPE.
+    """
+    index_type = FAISS_INDEX_TYPE
+    if index_type == "auto":
+        index_type = FAISS_ANN_TYPE if n_vectors >= FAISS_ANN_THRESHOLD else "flat"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type: {index_type}")
+    if n_vectors < MIN_TRAIN_VECTORS[index_type]:
+        return "flat"
+    return index_type
+
+def choose_storage(n_vectors, index_type):
+    """Vector encoding for the index: FAISS_STORAGE once it can be trained."""
+    if index_type == "ivf_pq":
+        return "pq"
+    storage = FAISS_STORAGE
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown FAISS storage type: {storage}")
+    if n_vectors < STORAGE_MIN_TRAIN[storage]:
+        return "float32"
+    return storage
+
+def _nlist_for(n_vectors):
+    nlist = FAISS_NLIST or int(4 * math.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // 39 or 1))
+
+def _storage_code(storage):
+    return {
+        "float32": "Flat",
+        "fp16": "SQfp16",
+        "sq8": "SQ8",
+        "pq": f"PQ{FAISS_PQ_M}",
+    }[storage]
+
+def build_index(index_type, dim, training_vectors=None, storage="float32"):
+    """
+    Return an empty, trained index that accepts add_with_ids/search with
+    the store's integer labels.
+
+    IVF indexes carry ids natively (with a hashtable direct map so that
+    remove_ids and reconstruct work); flat and HNSW are wrapped in IDMap2.
+    storage selects the vector encoding: float32, fp16 / sq8 scalar
+    quantization, or product quantization.
+    """
+    n_vectors = 0 if training_vectors is None else len(training_vectors)
+    if index_type == "ivf_pq":
+        storage = "pq"
+    code = _storage_code(storage)
+
+    if index_type == "flat":
+        index = faiss.index_factory(dim, f"IDMap2,{code}")
+    elif index_type == "hnsw":
+        suffix = "" if storage == "float32" else f",{code}"
+        index = faiss.index_factory(dim, f"IDMap2,HNSW{FAISS_HNSW_M}{suffix}")
+        faiss.downcast_index(index.index).hnsw.efSearch = FAISS_EF_SEARCH
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist_for(n_vectors)
+        index = faiss.index_factory(dim, f"IVF{nlist},{code}")
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.nprobe = min(FAISS_NPROBE, nlist)
+    else:
+        raise ValueError(f"Unknown FAISS index type: {index_type}")
+
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(training_vectors, dtype="float32"))
+    return index
+
+def _inner(index):
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+def index_type_of(index):
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def storage_of(index):
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ, faiss.IndexHNSWPQ)):
+        return "pq"
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "float32"
+
+def is_upgrade(index, index_type, storage):
+    """True when (index_type, storage) is a trained upgrade over index."""
+    return (
+        (index_type_of(index) == "flat" and index_type != "flat")
+        or (storage_of(index) == "float32" and storage != "float32")
+    )
+
+def supports_remove(index_type):
+    # HNSW graphs cannot drop nodes; removed labels are left as tombstones
+    return index_type != "hnsw"
+
+def index_labels(index):
+    """Labels stored in an index, in storage order."""
+    if index.ntotal == 0:
+        return np.zeros(0, dtype="int64")
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    invlists = index.invlists
+    labels = []
+    for list_no in range(index.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            labels.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+    return np.concatenate(labels).astype("int64")
+
+def export_vectors(index):
+    """Return (labels, vectors) for everything stored in an index."""
+    labels = index_labels(index)
+    if not len(labels):
+        return labels, np.zeros((0, index.d), dtype="float32")
+    if isinstance(index, faiss.IndexIDMap):
+        return labels, faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    return labels, index.reconstruct_batch(labels)
+
+def search_params(index, k, nprobe=None, ef_search=None, sel=None, selectivity=1.0):
+    """
+    Per-query search parameters. With a selective ID filter fewer vectors in
+    each probed list or graph neighbourhood qualify, so the search effort is
+    widened in proportion to keep roughly k matches reachable.
+    """
+    index_type = index_type_of(index)
+    widen = 1.0 / max(selectivity, 1e-6)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nprobe = math.ceil((nprobe or index.nprobe) * widen)
+        return faiss.SearchParametersIVF(sel=sel, nprobe=int(min(nprobe, index.nlist)))
+    if index_type == "hnsw":
+        ef_search = max(ef_search or FAISS_EF_SEARCH, math.ceil(k * widen))
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=int(min(ef_search, MAX_EF_SEARCH)))
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+def _recall(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / float(len(truth) * k)
+
+def storage_report(vectors, k=10, n_queries=200, index_type=None, rerank_factor=FAISS_RERANK_FACTOR, seed=0):
+    """
+    Build the index once per storage type over the same vectors and report
+    bytes per vector (serialized index size / vectors) and recall@k against
+    an exact float32 scan, with and without exact re-ranking.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors = len(vectors)
+    if n_vectors == 0:
+        return {"vectors": 0, "settings": []}
+    index_type = index_type or choose_index_type(n_vectors)
+    k = min(k, n_vectors)
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(n_vectors, size=min(n_queries, n_vectors), replace=False)]
+    labels = np.arange(n_vectors, dtype="int64")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    settings = []
+    for storage in STORAGE_TYPES:
+        if n_vectors < STORAGE_MIN_TRAIN[storage] or (index_type == "ivf_pq" and storage != "pq"):
+            continue
+        index = build_index(index_type, vectors.shape[1], vectors, storage)
+        index.add_with_ids(vectors, labels)
+
+        started = time.perf_counter()
+        _, found = index.search(queries, k, params=search_params(index, k))
+        elapsed = time.perf_counter() - started
+
+        row = {
+            "storage": storage,
+            "index_type": index_type_of(index),
+            "bytes_per_vector": round(len(faiss.serialize_index(index)) / n_vectors, 1),
+            f"recall@{k}": round(_recall(found, truth), 4),
+            "ms_per_query": round(elapsed * 1000 / len(queries), 3),
+        }
+        if storage != "float32" and rerank_factor > 1:
+            fetch = min(k * rerank_factor, n_vectors)
+            _, candidates = index.search(queries, fetch, params=search_params(index, fetch))
+            reranked = []
+            for query, cand in zip(queries, candidates):
+                cand = cand[cand >= 0]
+                dist = ((vectors[cand] - query) ** 2).sum(axis=1)
+                reranked.append(cand[np.argsort(dist, kind="stable")[:k]])
+            row[f"recall@{k}_reranked"] = round(_recall(reranked, truth), 4)
+        settings.append(row)
+
+    return {
+        "vectors": n_vectors,
+        "dim": int(vectors.shape[1]),
+        "k": k,
+        "queries": len(queries),
+        "settings": settings,
+    }
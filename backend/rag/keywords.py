@@ -0,0 +1,145 @@
+import re
+
+LETTERS_RE = re.compile(r"[a-z]+")
+
+# a pattern such as r"\bwave(s)?\b": every match is one whole \w+ run
+WORD_PATTERN_RE = re.compile(r"\\b[\w()?]+\\b")
+
+# distinct tokens remembered per counter before the memo starts over
+MEMO_SIZE = 50000
+
+def lowercase_twin(regex):
+    """
+    The IGNORECASE regex compiled without it, or None. On lowercase ASCII
+    text it matches exactly where the original does, and re can then use
+    its literal-prefix search, which IGNORECASE turns off.
+    """
+    pattern = regex.pattern
+    if not regex.flags & re.IGNORECASE or not pattern.isascii() or pattern != pattern.lower():
+        return None
+    return re.compile(pattern, regex.flags & ~re.IGNORECASE)
+
+class PatternCounter:
+    """
+    Counts how many patterns of each group occur in a text, the same as
+    sum(1 for p in patterns if re.search(p, text, flags)) per group, in
+    one tokenizing pass.
+
+    A whole-word pattern can only match a complete \\w+ run, so each
+    distinct run is matched against all of them once and the hits are
+    memoized; a text is then one findall plus dict lookups. Other
+    patterns (phrases, \\s+, bare prefixes) are searched as before, and
+    search() tries all of them through a single combined alternation;
+    lowercase ASCII text is searched without IGNORECASE (lowercase_twin).
+    """
+
+    def __init__(self, groups, flags=re.IGNORECASE):
+        self.groups = {group: list(patterns) for group, patterns in groups.items()}
+        self.flags = flags
+        self.word_re = re.compile(r"\w+", flags & re.ASCII)
+        self.word_patterns = []
+        self.phrase_patterns = []
+        for group, patterns in self.groups.items():
+            for pattern in patterns:
+                core = re.compile(pattern[2:-2], flags) if WORD_PATTERN_RE.fullmatch(pattern) else None
+                if core is not None and not core.fullmatch(""):
+                    self.word_patterns.append((group, pattern, core))
+                else:
+                    regex = re.compile(pattern, flags)
+                    self.phrase_patterns.append((group, regex, lowercase_twin(regex) or regex))
+        self.combined = self.combined_lower = None
+        if self.phrase_patterns:
+            self.combined = re.compile("|".join(f"(?:{regex.pattern})" for _, regex, _ in self.phrase_patterns), flags)
+            self.combined_lower = lowercase_twin(self.combined) or self.combined
+        self.memo = {}
+
+    def _token_hits(self, token):
+        hits = self.memo.get(token)
+        if hits is None:
+            hits = tuple(i for i, (_, _, regex) in enumerate(self.word_patterns) if regex.fullmatch(token))
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo = {}
+            self.memo[token] = hits
+        return hits
+
+    def _word_hits(self, text):
+        hits = set()
+        for token in set(self.word_re.findall(text)):
+            hits.update(self._token_hits(token))
+        return hits
+
+    def counts(self, text):
+        counts = dict.fromkeys(self.groups, 0)
+        for i in self._word_hits(text):
+            counts[self.word_patterns[i][0]] += 1
+        lower = text.isascii() and text.islower()
+        for group, regex, twin in self.phrase_patterns:
+            if (twin if lower else regex).search(text):
+                counts[group] += 1
+        return counts
+
+    def search(self, text):
+        """Whether any pattern occurs in text."""
+        combined = self.combined_lower if text.isascii() and text.islower() else self.combined
+        if combined is not None and combined.search(text):
+            return True
+        return bool(self.word_patterns) and bool(self._word_hits(text))
+
+    def reference_counts(self, text):
+        return {
+            group: sum(1 for pattern in patterns if re.search(pattern, text, self.flags))
+            for group, patterns in self.groups.items()
+        }
+
+    def reference_search(self, text):
+        return any(
+            re.search(pattern, text, self.flags) for patterns in self.groups.values() for pattern in patterns
+        )
+
+class SubstringCounter:
+    """
+    Counts how many keywords of each group are substrings of a text, the
+    same as sum(1 for k in keywords if k in text) per group.
+
+    A lowercase keyword can only occur inside a run of [a-z], so each
+    distinct run is checked against every keyword once and the keywords
+    it contains are memoized; a text is then one findall plus dict
+    lookups. Keywords with other characters are checked directly.
+    """
+
+    def __init__(self, groups):
+        self.groups = {group: list(keywords) for group, keywords in groups.items()}
+        owners = {}
+        for group, keywords in self.groups.items():
+            for keyword in keywords:
+                owners.setdefault(keyword, []).append(group)
+        self.owners = owners
+        self.letter_keywords = [keyword for keyword in owners if LETTERS_RE.fullmatch(keyword)]
+        self.other_keywords = [keyword for keyword in owners if not LETTERS_RE.fullmatch(keyword)]
+        self.memo = {}
+
+    def _run_keywords(self, run):
+        found = self.memo.get(run)
+        if found is None:
+            found = tuple(keyword for keyword in self.letter_keywords if keyword in run)
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo = {}
+            self.memo[run] = found
+        return found
+
+    def counts(self, text):
+        found = set()
+        for run in set(LETTERS_RE.findall(text)):
+            found.update(self._run_keywords(run))
+        found.update(keyword for keyword in self.other_keywords if keyword in text)
+        counts = dict.fromkeys(self.groups, 0)
+        for keyword in found:
+            for group in self.owners[keyword]:
+                counts[group] += 1
+        return counts
+
+    def reference_counts(self, text):
+        return {
+            group: sum(1 for keyword in keywords if keyword in text)
+            for group, keywords in self.groups.items()
+        }
@@ -0,0 +1,160 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were which with what when where who will".split()
+)
+
+def tokenize(text):
+    """Lowercased word and number tokens; decimals such as 9.8 stay whole."""
+    return [token for token in TOKEN_RE.findall(str(text or "").lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """
+    Okapi BM25 over the same integer labels as the FAISS index, so the
+    store's id map and metadata filters apply unchanged.
+
+    Each term's postings are two parallel arrays (labels, term frequencies)
+    and a query is scored with vectorized updates of one dense score array.
+    Removed documents keep their postings until enough accumulate to
+    compact; they are excluded through their zero length. Like the rest of
+    a snapshot, a published index is never modified: copy() shares posting
+    arrays and add() / discard() replace the arrays they touch.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = np.zeros(0, dtype="float32")
+        self.docs = 0
+        self.total_length = 0.0
+        self.dead = 0
+
+    def __len__(self):
+        return self.docs
+
+    def copy(self):
+        other = BM25Index(self.k1, self.b)
+        other.postings = dict(self.postings)
+        other.lengths = self.lengths.copy()
+        other.docs = self.docs
+        other.total_length = self.total_length
+        other.dead = self.dead
+        return other
+
+    def add(self, labels, texts):
+        labels = np.asarray(labels, dtype="int64")
+        if not len(labels):
+            return
+        self.discard(labels)
+        if labels.max() >= len(self.lengths):
+            lengths = np.zeros(int(labels.max()) + 1, dtype="float32")
+            lengths[:len(self.lengths)] = self.lengths
+            self.lengths = lengths
+
+        grouped = {}
+        for label, text in zip(labels, texts):
+            counts = Counter(tokenize(text))
+            length = sum(counts.values())
+            if not length:
+                continue
+            self.lengths[label] = length
+            self.docs += 1
+            self.total_length += length
+            for term, tf in counts.items():
+                grouped.setdefault(term, ([], []))
+                grouped[term][0].append(label)
+                grouped[term][1].append(tf)
+
+        for term, (term_labels, tfs) in grouped.items():
+            new_labels = np.array(term_labels, dtype="int64")
+            new_tfs = np.array(tfs, dtype="float32")
+            old = self.postings.get(term)
+            if old is not None:
+                new_labels = np.concatenate([old[0], new_labels])
+                new_tfs = np.concatenate([old[1], new_tfs])
+            self.postings[term] = (new_labels, new_tfs)
+
+    def discard(self, labels):
+        labels = np.asarray(labels, dtype="int64")
+        labels = labels[labels < len(self.lengths)]
+        live = labels[self.lengths[labels] > 0]
+        if not len(live):
+            return
+        self.docs -= len(live)
+        self.total_length -= float(self.lengths[live].sum())
+        self.lengths[live] = 0
+        self.dead += len(live)
+        if self.dead > 0.2 * max(self.docs, 1):
+            self._compact()
+
+    def _compact(self):
+        postings = {}
+        for term, (labels, tfs) in self.postings.items():
+            keep = self.lengths[labels] > 0
+            if keep.any():
+                postings[term] = (labels[keep], tfs[keep])
+        self.postings = postings
+        self.dead = 0
+
+    def scores(self, query):
+        """Dense BM25 scores indexed by label (0 for non-matching labels)."""
+        scores = np.zeros(len(self.lengths), dtype="float32")
+        if not self.docs:
+            return scores
+        avgdl = self.total_length / self.docs
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            labels, tfs = posting
+            df = int(np.count_nonzero(self.lengths[labels]))
+            if not df:
+                continue
+            idf = math.log(1.0 + (self.docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.lengths[labels] / avgdl)
+            scores[labels] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+        scores[self.lengths == 0] = 0
+        return scores
+
+    def search(self, query, k, mask=None):
+        """Top-k (labels, scores) with positive score, restricted to mask if given."""
+        if k <= 0:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        scores = self.scores(query)
+        if mask is not None:
+            size = min(len(scores), len(mask))
+            scores = scores[:size] * mask[:size]
+        matches = np.flatnonzero(scores > 0)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        order = np.argsort(-scores[matches], kind="stable")
+        return matches[order], scores[matches[order]]
+
+    def state(self):
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "postings": self.postings,
+            "lengths": self.lengths,
+            "docs": self.docs,
+            "total_length": self.total_length,
+            "dead": self.dead,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls(state["k1"], state["b"])
+        index.postings = state["postings"]
+        index.lengths = state["lengths"]
+        index.docs = state["docs"]
+        index.total_length = state["total_length"]
+        index.dead = state["dead"]
+        return index
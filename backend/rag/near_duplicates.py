@@ -0,0 +1,105 @@
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+from config import NEAR_DUPLICATE_MIN_JACCARD
+from rag.validation import normalize_text
+
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 4
+MINHASH_BYTES = MINHASH_PERMUTATIONS * 4
+NUMBERS_DIGEST_BYTES = 8
+SIGNATURE_BYTES = MINHASH_BYTES + NUMBERS_DIGEST_BYTES
+
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 1 << 31, size=MINHASH_PERMUTATIONS).astype("uint64")
+_B = _rng.randint(0, 1 << 31, size=MINHASH_PERMUTATIONS).astype("uint64")
+
+def _shingles(text):
+    # character shingles survive OCR slips (rn/m, l/1, dropped spaces)
+    # that would change every word n-gram they touch
+    t = re.sub(r"[^a-z0-9]+", " ", normalize_text(text).lower()).strip()
+    if len(t) <= SHINGLE_SIZE:
+        return {t} if t else set()
+    return {t[i:i + SHINGLE_SIZE] for i in range(len(t) - SHINGLE_SIZE + 1)}
+
+def _numbers_digest(text):
+    # "2 kg" and "5 kg" versions of a question share almost every shingle
+    # but are different questions, so their numbers must match exactly
+    numbers = NUMBER_RE.findall(normalize_text(text).lower())
+    return hashlib.blake2b(" ".join(numbers).encode("ascii"), digest_size=NUMBERS_DIGEST_BYTES).digest()
+
+def minhash(text):
+    """
+    MINHASH_PERMUTATIONS uint32 minima of the text's shingle set, followed
+    by a digest of its numbers in order, as bytes.
+    """
+    shingles = _shingles(text)
+    if not shingles:
+        return np.full(MINHASH_PERMUTATIONS, 0xFFFFFFFF, dtype="uint32").tobytes() + _numbers_digest(text)
+    x = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype="uint64")
+    # a * x + b stays below 2**64 since a, b < 2**31 and x < 2**32
+    hashed = ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME) & np.uint64(0xFFFFFFFF)
+    return hashed.min(axis=1).astype("uint32").tobytes() + _numbers_digest(text)
+
+def lsh_buckets(signature):
+    """One signed 64-bit bucket key per band of LSH_ROWS minima."""
+    values = np.frombuffer(signature[:MINHASH_BYTES], dtype="uint32")
+    buckets = []
+    for band in range(LSH_BANDS):
+        digest = hashlib.blake2b(
+            bytes([band]) + values[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(),
+            digest_size=8,
+        ).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+def estimated_jaccard(a, b):
+    return float(np.mean(
+        np.frombuffer(a[:MINHASH_BYTES], dtype="uint32") == np.frombuffer(b[:MINHASH_BYTES], dtype="uint32")
+    ))
+
+def same_numbers(a, b):
+    """Whether both signatures carry the same numbers digest."""
+    return a[MINHASH_BYTES:] == b[MINHASH_BYTES:]
+
+class ClusterIndex:
+    """
+    LSH buckets of known (signature, cluster_id) pairs. find() only compares
+    signatures sharing a bucket with the query, so each lookup costs O(1)
+    in the size of the bank, and only those with the same numbers.
+    """
+
+    def __init__(self, min_jaccard=NEAR_DUPLICATE_MIN_JACCARD):
+        self.min_jaccard = min_jaccard
+        self.buckets = {}
+
+    def add(self, signature, cluster_id):
+        for bucket in lsh_buckets(signature):
+            self.buckets.setdefault(bucket, []).append((signature, cluster_id))
+
+    def find(self, signature):
+        """Cluster of the most similar known signature above min_jaccard, or None."""
+        best = None
+        best_similarity = self.min_jaccard
+        for bucket in lsh_buckets(signature):
+            for other, cluster_id in self.buckets.get(bucket, ()):
+                if not same_numbers(signature, other):
+                    continue
+                similarity = estimated_jaccard(signature, other)
+                if similarity >= best_similarity and (best is None or similarity > best_similarity):
+                    best, best_similarity = cluster_id, similarity
+        return best
+
+    def assign(self, signature, own_id):
+        """Join the closest cluster, or start one named after own_id."""
+        cluster_id = self.find(signature) or own_id
+        self.add(signature, cluster_id)
+        return cluster_id
@@ -1,8 +1,24 @@
 print("LOADING retrieval")
 
+import numpy as np
+from sqlalchemy import func, true
+
+from config import RETRIEVAL_CACHE_SIZE, RETRIEVAL_MAX_K, RRF_K
+
 from rag.validation import normalize_text, is_valid_question_text, detect_subject_from_text
 from rag.embeddings import get_faiss_store
-from database.models import Question
+from rag.warmup import semantic_available
+from rag.lru import LRUCache
+from rag.topics import TopicSimilarityMatrix
+from rag.diversity import mmr_order
+from database.corpus import corpus_version
+from database.models import Question, Topic
+
+# ranked question ids of recent retrievals; the key carries the corpus and
+# index versions, so entries from before an ingest are never hit again
+_retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+# topic values passing each topic filter, keyed by the index version
+_topic_filter_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
 
 def _topic_similarity(topic1, topic2):
     if not topic1 or not topic2:
@@ -36,88 +52,394 @@ def _topic_similarity(topic1, topic2):
             return 0.6
     return 0.0
 
-def filter_questions_by_subject(session, subject, k=10):
-    query = session.query(Question).filter(Question.question_text.isnot(None))
+# similarity of every pair of Topic names, and the names by Topic id
+_topic_matrix = TopicSimilarityMatrix(_topic_similarity)
+_topic_names = {}
+
+def question_dedupe_key(q):
+    """Near-duplicate cluster of a question, or its exact text before the backfill."""
+    return q.cluster_id or q.text_hash or normalize_text(q.question_text).lower()
+
+class CandidateRow:
+    """
+    The columns retrieval scores and dedupes on. Candidates are loaded as
+    these instead of full Question rows; question_text is fetched only for
+    rows whose validity, dedupe key or topic was not computed at ingest.
+    """
+
+    __slots__ = ("id", "subject", "topic_id", "topic", "difficulty", "is_valid", "dedupe_key", "question_text")
+
+    def __init__(self, id, subject, topic_id, difficulty, is_valid, dedupe_key, question_text=None):
+        self.id = id
+        self.subject = subject
+        self.topic_id = topic_id
+        self.topic = _topic_names.get(topic_id)
+        self.difficulty = difficulty
+        self.is_valid = is_valid
+        self.dedupe_key = dedupe_key
+        self.question_text = question_text
+
+    def resolved_topic(self):
+        return self.topic or detect_subject_from_text(self.question_text, self.subject)
+
+def _load_topic_names(session, topic_ids):
+    missing = {topic_id for topic_id in topic_ids if topic_id is not None and topic_id not in _topic_names}
+    if missing:
+        loaded = dict(session.query(Topic.id, Topic.name).filter(Topic.id.in_(missing)).all())
+        _topic_names.update(loaded)
+        _topic_matrix.add(list(loaded.values()))
+
+def _matching_topic_names(store, topic_filter):
+    """
+    Indexed topic values close enough to topic_filter to pass it, by the
+    same similarity test _topic_scores applies to each candidate, so the
+    filter can run on the indexed topic field instead. None is always
+    included: questions without a topic are kept in the search and
+    resolved from their text by _topic_scores, as before the prefilter.
+    """
+    key = (topic_filter, store.index_version("questions"))
+    names = _topic_filter_cache.get(key)
+    if names is None:
+        values = store.filter_values("questions", "topic")
+        similarities = _topic_matrix.scores([topic_filter], values)[:, 0] if values else []
+        names = [value for value, similarity in zip(values, similarities) if similarity >= 0.25] + [None]
+        _topic_filter_cache.put(key, names)
+    return names
+
+def _candidate_rows(session, ids, need_topic=False):
+    rows = (
+        session.query(
+            Question.id,
+            Question.subject,
+            Question.topic_id,
+            Question.difficulty,
+            Question.is_valid,
+            func.coalesce(Question.cluster_id, Question.text_hash),
+        )
+        .filter(Question.id.in_(ids))
+        .all()
+    )
+    _load_topic_names(session, [row[2] for row in rows])
+    candidates = {row[0]: CandidateRow(*row) for row in rows}
+    # rows without ingest-time values (before the backfill, or no topic)
+    needs_text = [
+        c.id for c in candidates.values()
+        if c.is_valid is None or c.dedupe_key is None or (need_topic and c.topic_id is None)
+    ]
+    if needs_text:
+        for question_id, question_text, topic in (
+            session.query(Question.id, Question.question_text, Question.topic).filter(Question.id.in_(needs_text))
+        ):
+            c = candidates[question_id]
+            c.question_text = question_text or ""
+            c.topic = topic
+            if c.is_valid is None:
+                c.is_valid = is_valid_question_text(c.question_text)
+            if c.dedupe_key is None:
+                c.dedupe_key = normalize_text(c.question_text).lower()
+    return candidates
+
+def hydrate_questions(session, ids):
+    """Full Question rows for ids, in the order given."""
+    if not ids:
+        return []
+    q_by_id = {q.id: q for q in session.query(Question).filter(Question.id.in_(ids)).all()}
+    return [q_by_id[i] for i in ids if i in q_by_id]
+
+def iter_questions(session, ids, page_size=25):
+    """Yield Question rows for ids in order, loading page_size rows at a time."""
+    page_size = max(int(page_size), 1)
+    for start in range(0, len(ids), page_size):
+        yield from hydrate_questions(session, ids[start:start + page_size])
+
+def stream_questions(session, rank, first_k, max_k=RETRIEVAL_MAX_K, page_size=25):
+    """
+    Yield Question rows in the order of rank(k=...), a function returning
+    ranked ids, without deciding the depth up front. The first list has
+    first_k ids and is hydrated page_size rows at a time. Only when the
+    consumer reads past its end is rank called again with twice the k, and
+    the ids not seen yet are streamed from that list. A list shorter than k
+    does not mean the ranking is exhausted (it drops invalid, off-topic and
+    duplicate rows after fetching), so this stops only when a deeper list
+    brings no new ids, or at max_k.
+    """
+    seen = set()
+    k = max(min(first_k, max_k), 1)
+    while True:
+        fresh = [question_id for question_id in rank(k=k) if question_id not in seen]
+        if not fresh:
+            return
+        seen.update(fresh)
+        yield from iter_questions(session, fresh, page_size=page_size)
+        if k >= max_k:
+            return
+        k = min(k * 2, max_k)
+
+def _filter_questions_by_subject_scan(session, subject, k):
+    # rows ingested before is_valid / text_hash existed: validate in Python
+    query = session.query(Question.id, Question.question_text).filter(Question.question_text.isnot(None))
     if subject and subject != "All":
         query = query.filter(Question.subject == subject)
-    questions = query.order_by(Question.created_at.asc()).all()
+    rows = query.order_by(Question.created_at.asc()).all()
 
     seen = set()
     out = []
-    for q in questions:
-        txt = q.question_text or ""
+    for question_id, txt in rows:
+        txt = txt or ""
         if not is_valid_question_text(txt):
             continue
         norm = normalize_text(txt).lower()
         if norm in seen:
             continue
         seen.add(norm)
-        out.append(q)
+        out.append(question_id)
         if len(out) >= k:
             break
     return out
 
-def retrieve_relevant_questions(session, query_text, subject, k=10, topic_filter=None, weak_topics_weights=None, difficulty=None):
+def diversify_question_ids(ids, relevance, diversity, select=None, store=None):
+    """
+    Reorder ranked question ids by maximal marginal relevance over their
+    stored embeddings, so the first `select` ids cover more sub-concepts.
+    relevance defaults to rank order. diversity 0 keeps the ranking.
+    """
+    if diversity <= 0 or len(ids) < 2:
+        return ids
+    if relevance is None:
+        relevance = np.arange(len(ids), 0, -1, dtype="float32")
+    vectors = (store or get_faiss_store()).question_vectors(ids)
+    return [ids[i] for i in mmr_order(relevance, vectors, diversity, select=select)]
+
+def filter_question_ids_by_subject(session, subject, k=10, diversity=0.0, select=None):
+    """
+    Ids of the k oldest valid questions of a subject, one per near-duplicate
+    cluster. Validity and cluster are computed at ingest, so this is a
+    grouped query over ix_questions_subject_valid_cluster: the first
+    created_at of each cluster, the smallest id at that time, then LIMIT k.
+    With diversity > 0 they are reordered by MMR once the index is available.
     """
-    Semantic retrieval using FAISS + optional weighted topic boosting.
-    Returns SQLAlchemy Question objects sorted by final score.
+    unprocessed = Question.is_valid.is_(None) | Question.cluster_id.is_(None)
+    if session.query(Question.id).filter(unprocessed).first() is not None:
+        print("Questions missing is_valid / cluster_id, run python backfill.py; scanning instead")
+        return _filter_questions_by_subject_scan(session, subject, k)
+
+    def valid_in_subject(query):
+        # "= true" rather than "IS true", so the index can seek on it
+        query = query.filter(Question.is_valid == true())
+        if subject and subject != "All":
+            query = query.filter(Question.subject == subject)
+        return query
+
+    first_of_cluster = valid_in_subject(
+        session.query(Question.cluster_id.label("cluster_id"), func.min(Question.created_at).label("created_at"))
+    ).group_by(Question.cluster_id).subquery()
+    first_id = func.min(Question.id)
+    rows = (
+        valid_in_subject(session.query(first_id))
+        .join(
+            first_of_cluster,
+            (Question.cluster_id == first_of_cluster.c.cluster_id)
+            & (Question.created_at == first_of_cluster.c.created_at),
+        )
+        .group_by(Question.cluster_id, Question.created_at)
+        .order_by(Question.created_at.asc(), first_id.asc())
+        .limit(k)
+        .all()
+    )
+    ids = [row[0] for row in rows]
+    if diversity > 0 and semantic_available():
+        ids = diversify_question_ids(ids, None, diversity, select=select)
+    return ids
+
+def filter_questions_by_subject(session, subject, k=10):
+    return hydrate_questions(session, filter_question_ids_by_subject(session, subject, k))
+
+def _retrieval_cache_key(
+    session, store, query_text, subject, k, topic_filter, weak_topics_weights, difficulty, diversity, select
+):
+    query = tuple(query_text) if isinstance(query_text, (list, tuple)) else query_text
+    weights = tuple(sorted((str(topic), round(float(weight), 6)) for topic, weight in weak_topics_weights.items()))
+    return (
+        query,
+        subject,
+        k,
+        topic_filter,
+        difficulty,
+        weights,
+        diversity,
+        select,
+        corpus_version(session),
+        store.index_version("questions"),
+    )
+
+def retrieval_cache_stats():
+    return _retrieval_cache.stats()
+
+def _merge_batch_results(batch, key="distance", higher_is_better=False):
+    best = {}
+    for results in batch:
+        for r in results:
+            current = best.get(r["id"])
+            if current is None or (r[key] > current[key] if higher_is_better else r[key] < current[key]):
+                best[r["id"]] = r
+    return sorted(best.values(), key=lambda r: r[key], reverse=higher_is_better)
+
+def _fuse_rankings(*rankings):
+    """
+    Reciprocal rank fusion: each id scores sum(1 / (RRF_K + rank)) over the
+    result lists it appears in, scaled so an id ranked first in every
+    non-empty list scores 1.0. Returns [(id, score)] best first.
+    """
+    rankings = [ranking for ranking in rankings if ranking]
+    fused = {}
+    for ranking in rankings:
+        for rank, r in enumerate(ranking, start=1):
+            fused[r["id"]] = fused.get(r["id"], 0.0) + 1.0 / (RRF_K + rank)
+    scale = (RRF_K + 1) / max(len(rankings), 1)
+    return sorted(((doc_id, score * scale) for doc_id, score in fused.items()), key=lambda x: x[1], reverse=True)
+
+def _topic_scores(candidates, topic_filter, weak_topics_weights):
+    """
+    Weak-topic boost of each candidate and whether it passes topic_filter,
+    gathered from the topic similarity matrix in one step instead of
+    comparing topic strings per candidate and weak topic. Same values as
+    calling _topic_similarity pair by pair.
+    """
+    bonus = np.zeros(len(candidates))
+    matches = np.ones(len(candidates), dtype=bool)
+    if not candidates or not (topic_filter or weak_topics_weights):
+        return bonus, matches
+
+    scores = _topic_matrix.scores([topic_filter] + list(weak_topics_weights), [c.resolved_topic() for c in candidates])
+    if topic_filter:
+        matches = scores[:, 0] >= 0.25
+    if weak_topics_weights:
+        weights = np.array([float(weight) for weight in weak_topics_weights.values()])
+        sims = scores[:, 1:]
+        bonus = np.maximum(np.where(sims > 0.25, sims * weights, 0.0).max(axis=1), 0.0)
+    return bonus, matches
+
+def rank_relevant_question_ids(
+    session,
+    query_text,
+    subject,
+    k=10,
+    topic_filter=None,
+    weak_topics_weights=None,
+    difficulty=None,
+    diversity=0.0,
+    select=None,
+):
+    """
+    Hybrid retrieval: FAISS and BM25 candidates fused by reciprocal rank,
+    plus optional weighted topic boosting.
+    query_text may be a list of queries; they are searched in one batch and
+    each question keeps its best distance / BM25 score.
+    Scores projected CandidateRow records and returns up to k question ids,
+    best first; see retrieve_relevant_questions for full rows. diversity > 0
+    reorders the first `select` ids by maximal marginal relevance.
     """
     weak_topics_weights = weak_topics_weights or {}
+    if not semantic_available():
+        return filter_question_ids_by_subject(session, subject, k)
 
-    # semantic candidates
-    sem_results = get_faiss_store().search_questions(query_text or "", k=max(k * 5, 20))
-    if not sem_results:
-        return filter_questions_by_subject(session, subject, k)
+    # semantic and lexical candidates, both restricted to the subject (and
+    # the topics passing topic_filter) inside the store
+    store = get_faiss_store()
+    cache_key = _retrieval_cache_key(
+        session, store, query_text, subject, k, topic_filter, weak_topics_weights, difficulty, diversity, select
+    )
+    cached_ids = _retrieval_cache.get(cache_key)
+    if cached_ids is not None:
+        return cached_ids
 
-    ids = [r["id"] for r in sem_results]
-    questions = session.query(Question).filter(Question.id.in_(ids)).all()
-    q_by_id = {q.id: q for q in questions}
+    filters = {"subject": subject} if subject and subject != "All" else {}
+    if topic_filter:
+        filters["topic"] = _matching_topic_names(store, topic_filter)
+    filters = filters or None
+    fetch_k = max(k, 20)
+    if isinstance(query_text, (list, tuple)):
+        queries = [q or "" for q in query_text] or [""]
+        sem_results = _merge_batch_results(store.search_questions_batch(queries, k=fetch_k, filters=filters))
+        lex_results = _merge_batch_results(
+            store.search_questions_lexical_batch(queries, k=fetch_k, filters=filters),
+            key="score",
+            higher_is_better=True,
+        )
+    else:
+        sem_results = store.search_questions(query_text or "", k=fetch_k, filters=filters)
+        lex_results = store.search_questions_lexical(query_text or "", k=fetch_k, filters=filters)
+    fused = _fuse_rankings(sem_results, lex_results)
+    if not fused:
+        return filter_question_ids_by_subject(session, subject, k, diversity=diversity, select=select)
 
-    scored = []
-    for r in sem_results:
-        q = q_by_id.get(r["id"])
-        if not q:
+    candidates = _candidate_rows(
+        session,
+        [doc_id for doc_id, _ in fused],
+        need_topic=bool(topic_filter or weak_topics_weights),
+    )
+
+    kept = []
+    for doc_id, fused_score in fused:
+        c = candidates.get(doc_id)
+        if not c:
             continue
-        if subject and subject != "All" and q.subject != subject:
+        if subject and subject != "All" and c.subject != subject:
             continue
-        if not is_valid_question_text(q.question_text or ""):
+        if not c.is_valid:
+            continue
+        kept.append((fused_score, c))
+
+    topic_bonus, topic_match = _topic_scores([c for _, c in kept], topic_filter, weak_topics_weights)
+
+    scored = []
+    for (fused_score, c), bonus, matches in zip(kept, topic_bonus, topic_match):
+        if not matches:
             continue
-        if topic_filter:
-            q_topic = q.topic or detect_subject_from_text(q.question_text, q.subject)
-            if _topic_similarity(topic_filter, q_topic) < 0.25:
-                continue
-
-        semantic_score = 1.0 / (1.0 + max(r["distance"], 0.0))
-        topic_bonus = 0.0
-        if weak_topics_weights:
-            q_topic = q.topic or detect_subject_from_text(q.question_text, q.subject)
-            for weak_topic, weight in weak_topics_weights.items():
-                sim = _topic_similarity(q_topic, weak_topic)
-                if sim > 0.25:
-                    topic_bonus = max(topic_bonus, sim * float(weight))
         difficulty_bonus = 0.0
-        if difficulty and q.difficulty and q.difficulty == difficulty:
+        if difficulty and c.difficulty and c.difficulty == difficulty:
             difficulty_bonus = 0.05
 
-        final_score = semantic_score + topic_bonus + difficulty_bonus
-        scored.append((final_score, q))
+        final_score = fused_score + float(bonus) + difficulty_bonus
+        scored.append((final_score, c))
 
     scored.sort(key=lambda x: x[0], reverse=True)
 
     seen = set()
     out = []
-    for score, q in scored:
-        norm = normalize_text(q.question_text).lower()
-        if norm in seen:
+    out_scores = []
+    for score, c in scored:
+        if c.dedupe_key in seen:
             continue
-        seen.add(norm)
-        out.append(q)
+        seen.add(c.dedupe_key)
+        out.append(c.id)
+        out_scores.append(score)
         if len(out) >= k:
             break
 
     if out:
+        out = diversify_question_ids(out, out_scores, diversity, select=select, store=store)
+        _retrieval_cache.put(cache_key, out)
         return out
-    return filter_questions_by_subject(session, subject, k)
+    return filter_question_ids_by_subject(session, subject, k, diversity=diversity, select=select)
+
+def retrieve_relevant_questions(session, query_text, subject, k=10, topic_filter=None, weak_topics_weights=None, difficulty=None):
+    """
+    rank_relevant_question_ids hydrated into SQLAlchemy Question objects,
+    sorted by final score.
+    """
+    return hydrate_questions(
+        session,
+        rank_relevant_question_ids(
+            session,
+            query_text,
+            subject,
+            k=k,
+            topic_filter=topic_filter,
+            weak_topics_weights=weak_topics_weights,
+            difficulty=difficulty,
+        ),
+    )
 
 def topic_similarity(topic1, topic2):
     return _topic_similarity(topic1, topic2)
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import struct
+import time
+import zlib
+
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+JOURNAL_SUFFIX = ".journal"
+
+# payload length and crc32 in front of every journal entry
+_FRAME = struct.Struct("<II")
+
+class SnapshotError(Exception):
+    """A snapshot directory is incomplete or does not match its manifest."""
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class SnapshotDirectory:
+    """
+    Versioned, crash-safe index snapshots under one root directory.
+
+    Each save writes every file into a temporary directory, fsyncs it,
+    records sizes and sha256 checksums in manifest.json and renames the
+    directory to v<version>. The CURRENT pointer file is then replaced
+    atomically, so a crash at any point leaves the previous snapshot
+    intact. Files inside a committed version are never rewritten, which
+    is what makes memory-mapped loading safe.
+
+    Changes made after a version was committed go to its journal,
+    v<version>.journal next to it: one framed, checksummed entry per
+    change, fsynced before the change is acknowledged. Loading a version
+    replays its journal; a torn entry at the end is ignored.
+    """
+
+    def __init__(self, root, keep=2):
+        self.root = root
+        self.keep = max(keep, 1)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _versions(self):
+        versions = []
+        for path in self.root.iterdir():
+            if path.is_dir() and path.name.startswith("v") and path.name[1:].isdigit():
+                versions.append(int(path.name[1:]))
+        return sorted(versions)
+
+    def _path(self, version):
+        return self.root / f"v{version:06d}"
+
+    def current(self):
+        pointer = self.root / CURRENT_NAME
+        if not pointer.exists():
+            return None
+        name = pointer.read_text(encoding="utf-8").strip()
+        path = self.root / name
+        return path if path.is_dir() else None
+
+    def candidates(self):
+        """Committed snapshot directories, the CURRENT one first, then newest first."""
+        current = self.current()
+        paths = [current] if current else []
+        for version in reversed(self._versions()):
+            path = self._path(version)
+            if path != current:
+                paths.append(path)
+        return paths
+
+    def write(self, writer, manifest):
+        """
+        Commit a new snapshot. writer(directory) writes the data files and
+        returns nothing; manifest is extended with the file list and stored
+        alongside them. Returns the committed directory.
+        """
+        versions = self._versions()
+        version = versions[-1] + 1 if versions else 1
+        tmp = self.root / f".tmp-v{version:06d}-{os.getpid()}"
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir()
+        try:
+            writer(tmp)
+            files = {}
+            for path in sorted(tmp.iterdir()):
+                with open(path, "rb") as f:
+                    os.fsync(f.fileno())
+                files[path.name] = {"bytes": path.stat().st_size, "sha256": file_checksum(path)}
+            manifest = dict(manifest, version=version, created_at=time.time(), files=files)
+            with open(tmp / MANIFEST_NAME, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            _fsync_dir(tmp)
+
+            final = self._path(version)
+            os.rename(tmp, final)
+            _fsync_dir(self.root)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        pointer_tmp = self.root / f".{CURRENT_NAME}.tmp"
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            f.write(final.name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer_tmp, self.root / CURRENT_NAME)
+        _fsync_dir(self.root)
+
+        self._prune(version)
+        return final
+
+    def _prune(self, current_version):
+        for version in self._versions()[:-self.keep]:
+            if version != current_version:
+                shutil.rmtree(self._path(version), ignore_errors=True)
+        for path in self.root.glob(".tmp-*"):
+            shutil.rmtree(path, ignore_errors=True)
+        for path in self.root.glob(f"v*{JOURNAL_SUFFIX}"):
+            if not (self.root / path.name[:-len(JOURNAL_SUFFIX)]).is_dir():
+                path.unlink(missing_ok=True)
+
+    def journal_path(self, path):
+        return self.root / f"{path.name}{JOURNAL_SUFFIX}"
+
+    def append_journal(self, path, entry):
+        """Durably append one entry to the journal of snapshot directory path."""
+        payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.journal_path(path), "ab") as f:
+            f.write(_FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_journal(self, path):
+        """
+        Entries of a snapshot's journal, in order, up to the first torn or
+        corrupt one. The journal is cut back to that point, so entries
+        appended later are not hidden behind the torn one.
+        """
+        journal = self.journal_path(path)
+        if not journal.exists():
+            return []
+        entries = []
+        valid = 0
+        with open(journal, "rb") as f:
+            while True:
+                header = f.read(_FRAME.size)
+                if not header:
+                    break
+                payload = b""
+                if len(header) == _FRAME.size:
+                    length, crc = _FRAME.unpack(header)
+                    payload = f.read(length)
+                if len(header) < _FRAME.size or len(payload) < length or zlib.crc32(payload) != crc:
+                    print(f"Ignoring a torn entry at the end of {journal.name}")
+                    break
+                entries.append(pickle.loads(payload))
+                valid = f.tell()
+        if valid < journal.stat().st_size:
+            os.truncate(journal, valid)
+        return entries
+
+    def read_manifest(self, path, verify_checksums=False):
+        """
+        Load a snapshot's manifest and check that every file it lists has
+        the recorded size; raises SnapshotError. Hashing every file is
+        O(snapshot bytes), so the sha256 check is left to verify() unless
+        verify_checksums is set.
+        """
+        manifest_path = path / MANIFEST_NAME
+        if not manifest_path.exists():
+            raise SnapshotError(f"missing {MANIFEST_NAME}")
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except ValueError as exc:
+            raise SnapshotError(f"unreadable manifest: {exc}")
+        for name, expected in manifest.get("files", {}).items():
+            file_path = path / name
+            if not file_path.exists():
+                raise SnapshotError(f"missing {name}")
+            if file_path.stat().st_size != expected["bytes"]:
+                raise SnapshotError(f"{name} is {file_path.stat().st_size} bytes, expected {expected['bytes']}")
+            if verify_checksums and file_checksum(file_path) != expected["sha256"]:
+                raise SnapshotError(f"checksum mismatch for {name}")
+        return manifest
+
+    def verify(self, path):
+        """Names of the files in a snapshot whose sha256 differs from the manifest."""
+        manifest = self.read_manifest(path)
+        return [
+            name for name, expected in manifest.get("files", {}).items()
+            if file_checksum(path / name) != expected["sha256"]
+        ]
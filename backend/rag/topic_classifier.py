@@ -0,0 +1,62 @@
+import numpy as np
+
+from config import TOPIC_MIN_SIMILARITY
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+class TopicClassifier:
+    """
+    Nearest-centroid topics in the question embedding space. Each topic's
+    centroid is the mean of the embeddings of its name and keywords from a
+    TOPIC_MAP-shaped {subject: {topic: [keywords]}}, so the vectors already
+    stored for FAISS can be classified without training data, all in one
+    matrix product. A question whose subject is in the map only competes
+    among that subject's topics; one with another subject keeps its
+    fallback, as does any question below min_similarity.
+    """
+
+    def __init__(self, topic_map, embed, min_similarity=TOPIC_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.names = []
+        seeds = []
+        topic_subjects = []
+        for subject, topics in topic_map.items():
+            for topic, keywords in topics.items():
+                self.names.append(topic.title())
+                topic_subjects.append(subject)
+                seeds.append([topic] + list(keywords))
+
+        vectors = _normalize(embed([text for seed in seeds for text in seed]))
+        ends = np.cumsum([len(seed) for seed in seeds])
+        self.centroids = _normalize(np.vstack([
+            vectors[end - len(seed):end].mean(axis=0) for seed, end in zip(seeds, ends)
+        ]))
+        topic_subjects = np.array(topic_subjects, dtype=object)
+        self.subject_masks = {subject: topic_subjects == subject for subject in topic_map}
+        self.any_subject = np.ones(len(self.names), dtype=bool)
+        self.no_subject = np.zeros(len(self.names), dtype=bool)
+
+    def _mask(self, subject):
+        if not subject or subject == "All":
+            return self.any_subject
+        return self.subject_masks.get(subject, self.no_subject)
+
+    def classify(self, vectors, subjects, fallbacks):
+        """
+        Topic name for each vector, or its fallback when the subject has no
+        topics, the vector is all zeros, or no centroid is close enough.
+        """
+        if not len(vectors):
+            return []
+        similarities = _normalize(vectors) @ self.centroids.T
+        allowed = np.vstack([self._mask(subject) for subject in subjects])
+        similarities = np.where(allowed, similarities, -np.inf)
+        best = similarities.argmax(axis=1)
+        scores = similarities[np.arange(len(best)), best]
+        return [
+            self.names[topic] if score >= self.min_similarity else fallback
+            for topic, score, fallback in zip(best, scores, fallbacks)
+        ]
@@ -0,0 +1,97 @@
+import threading
+
+import numpy as np
+
+from rag.lru import LRUCache
+
+# query topics whose similarity rows are kept between requests
+ROW_CACHE_SIZE = 1024
+
+class TopicSimilarityMatrix:
+    """
+    Dense similarity matrix over the topic vocabulary, the names of Topic
+    rows. Each ordered pair is computed once with similarity(); add()
+    grows the matrix by one row and one column per new name. Readers look
+    up the vocabulary first and then read matrix, which is replaced (never
+    resized in place) when names are added, so lookups need no lock.
+
+    Topics that arrive with requests (a topic filter, weak topics, topics
+    detected from question text) are never added. row() compares one
+    against the vocabulary on the fly and keeps the last ROW_CACHE_SIZE
+    rows, so arbitrary request strings cannot grow the matrix.
+    """
+
+    def __init__(self, similarity, topics=(), row_cache_size=ROW_CACHE_SIZE):
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        self.vocabulary = {}
+        self.names = []
+        self.matrix = np.zeros((0, 0), dtype="float64")
+        self.rows = LRUCache(row_cache_size)
+        if topics:
+            self.add(list(topics))
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, topics):
+        """Add unseen names to the vocabulary."""
+        vocabulary = self.vocabulary
+        if any(topic not in vocabulary for topic in topics):
+            with self.lock:
+                self._add([topic for topic in dict.fromkeys(topics) if topic not in self.vocabulary])
+
+    def _add(self, topics):
+        if not topics:
+            return
+        names = self.names + topics
+        old = len(self.names)
+        matrix = np.zeros((len(names), len(names)), dtype="float64")
+        matrix[:old, :old] = self.matrix
+        # existing rows only need the new columns; new rows need every column
+        for i, a in enumerate(names):
+            for j in range(old if i < old else 0, len(names)):
+                matrix[i, j] = self.similarity(a, names[j])
+        self.matrix = matrix
+        self.names = names
+        vocabulary = dict(self.vocabulary)
+        vocabulary.update((topic, old + i) for i, topic in enumerate(topics))
+        self.vocabulary = vocabulary
+
+    def row(self, topic):
+        """
+        similarity(topic, name) for every vocabulary name, covering at
+        least the names added before the call.
+        """
+        index = self.vocabulary.get(topic)
+        if index is not None:
+            return self.matrix[index]
+        names = self.names
+        row = self.rows.get(topic)
+        if row is None or len(row) < len(names):
+            done = 0 if row is None else len(row)
+            tail = np.array([self.similarity(topic, name) for name in names[done:]], dtype="float64")
+            row = tail if row is None else np.concatenate([row, tail])
+            self.rows.put(topic, row)
+        return row
+
+    def scores(self, queries, topics):
+        """
+        similarity(query, topic) as a len(topics) x len(queries) array.
+        Vocabulary topics are gathered from each query's row; any other
+        topic is compared directly, once per distinct string.
+        """
+        vocabulary = self.vocabulary
+        indices = np.array([vocabulary.get(topic, -1) for topic in topics], dtype="int64")
+        known = indices >= 0
+        scores = np.zeros((len(topics), len(queries)), dtype="float64")
+        if known.any():
+            for j, query in enumerate(queries):
+                scores[known, j] = self.row(query)[indices[known]]
+        others = {}
+        for i in np.flatnonzero(~known):
+            topic = topics[i]
+            if topic not in others:
+                others[topic] = [self.similarity(query, topic) for query in queries]
+            scores[i] = others[topic]
+        return scores
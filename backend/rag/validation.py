@@ -1,7 +1,10 @@
 
+import hashlib
 import re
 from typing import List, Dict, Optional
 
+from rag.keywords import PatternCounter
+
 META_PATTERNS = [
     r"maximum marks", r"question paper", r"paper pattern", r"structure of the question paper",
     r"how many questions", r"answered out of", r"marking scheme", r"total marks",
@@ -31,6 +34,9 @@ SUBJECT_KEYWORDS = {
     ]
 }
 
+_META_COUNTER = PatternCounter({"meta": META_PATTERNS})
+_SUBJECT_COUNTER = PatternCounter(SUBJECT_KEYWORDS)
+
 def normalize_text(text) -> str:
     text = str(text or "")
     text = re.sub(r"[\uE000-\uF8FF]", " ", text)  # weird PDF glyphs
@@ -43,15 +49,10 @@ def clean_pdf_text(text) -> str:
     return normalize_text(text)
 
 def is_meta_question(text: str) -> bool:
-    t = normalize_text(text).lower()
-    return any(re.search(pat, t, re.IGNORECASE) for pat in META_PATTERNS)
+    return _META_COUNTER.search(normalize_text(text).lower())
 
 def subject_score_map(text: str) -> Dict[str, int]:
-    low = normalize_text(text).lower()
-    scores = {}
-    for subject, patterns in SUBJECT_KEYWORDS.items():
-        scores[subject] = sum(1 for pat in patterns if re.search(pat, low, re.IGNORECASE))
-    return scores
+    return _SUBJECT_COUNTER.counts(normalize_text(text).lower())
 
 def detect_subject_from_text(text: str, fallback: Optional[str] = None) -> Optional[str]:
     scores = subject_score_map(text)
@@ -99,6 +100,10 @@ def is_valid_question_text(text: str) -> bool:
         return False
     return True
 
+def question_text_hash(text) -> str:
+    """Dedupe key: sha1 of the normalized, lowercased question text."""
+    return hashlib.sha1(normalize_text(text).lower().encode("utf-8")).hexdigest()
+
 def is_meaningful_option(opt: str) -> bool:
     t = normalize_text(opt)
     if len(t) < 3:
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+
+class VectorFile:
+    """
+    Exact float32 vectors on disk, one row per FAISS label, read through a
+    memory map. Compressed indexes re-rank against it, and retraining reads
+    exact vectors from it instead of lossy reconstructions. Rows of removed
+    labels stay in place until a rebuild compacts the store into a new
+    file; labels are never reused and committed rows never rewritten, so
+    a row read by an older snapshot always holds the same vector.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self._mmap = None
+
+    def __len__(self):
+        if not self.path.exists():
+            return 0
+        return self.path.stat().st_size // self.row_bytes
+
+    def _view(self):
+        # readers take no lock and write() may clear the attribute at any
+        # moment, so it is read once and the local is what gets returned
+        rows = len(self)
+        view = self._mmap
+        if view is None or view.shape[0] != rows:
+            view = np.memmap(self.path, dtype="float32", mode="r", shape=(rows, self.dim)) if rows else None
+            self._mmap = view
+        return view
+
+    def write(self, labels, vectors):
+        labels = np.asarray(labels, dtype="int64")
+        if not len(labels):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._mmap = None
+        with open(self.path, "r+b" if self.path.exists() else "w+b") as f:
+            rows = len(self)
+            needed = int(labels.max()) + 1
+            if needed > rows:
+                f.truncate(needed * self.row_bytes)
+            if np.array_equal(labels, np.arange(labels[0], labels[0] + len(labels))):
+                f.seek(int(labels[0]) * self.row_bytes)
+                f.write(vectors.tobytes())
+                return
+            for label, vector in zip(labels, vectors):
+                f.seek(int(label) * self.row_bytes)
+                f.write(vector.tobytes())
+
+    def sync(self):
+        """fsync the file so the rows a snapshot refers to survive a crash."""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            os.fsync(f.fileno())
+
+    def read(self, labels):
+        labels = np.asarray(labels, dtype="int64")
+        view = self._view()
+        if view is None or not len(labels):
+            return np.zeros((len(labels), self.dim), dtype="float32")
+        return np.array(view[labels], dtype="float32")
+
+    def reset(self):
+        self._mmap = None
+        if self.path.exists():
+            self.path.unlink()
@@ -0,0 +1,288 @@
+import ipaddress
+import json
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+print("LOADING vector_service")
+
+from config import (
+    DEFAULT_SECRET_KEY,
+    VECTOR_SERVICE_ADDRESS,
+    VECTOR_SERVICE_AUTHKEY,
+    VECTOR_SERVICE_BATCH_WINDOW_MS,
+    VECTOR_SERVICE_MAX_BATCH,
+)
+
+# store methods a client may call directly; embed and search requests go
+# through the micro-batcher instead
+DIRECT_METHODS = (
+    "add_questions",
+    "add_images",
+    "remove_questions",
+    "remove_images",
+    "update_question_metadata",
+    "rebuild_from_rows",
+    "search_questions_lexical",
+    "search_questions_lexical_batch",
+    "question_vectors",
+    "filter_values",
+    "counts",
+    "index_info",
+    "index_version",
+    "is_consistent",
+    "semantic_search_ready",
+    "verify_snapshot",
+    "cache_stats",
+    "storage_report",
+    "warm_up",
+    "save",
+    "clear",
+)
+
+def _is_loopback(host):
+    # multiprocessing clients only connect over IPv4
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.IPv4Address(host).is_loopback
+    except ValueError:
+        return False
+
+def parse_address(address):
+    """
+    "host:port" for localhost TCP, anything else is a Unix socket path.
+    Connections unpickle their requests, so other hosts are refused.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and not address.startswith("/"):
+        host = host or "127.0.0.1"
+        if not _is_loopback(host):
+            raise ValueError(f"Vector service address must be a loopback host or a Unix socket, not {host}")
+        return (host, int(port)), "AF_INET"
+    return address, "AF_UNIX"
+
+class _Pending:
+    __slots__ = ("group", "payload", "result", "error", "done")
+
+    def __init__(self, group, payload):
+        self.group = group
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class MicroBatcher:
+    """
+    Collects embed and search requests from every connected worker for up
+    to window_ms (or max_batch requests) and runs each group of compatible
+    requests as one embed_texts / index search call. A request carrying
+    more than max_batch texts (an ingest embedding a whole PDF) runs on
+    the caller's thread instead, so it never holds up the queued searches.
+    """
+
+    def __init__(self, store, window_ms, max_batch):
+        self.store = store
+        self.window = window_ms / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.direct = 0
+        threading.Thread(target=self._run, name="vector-batcher", daemon=True).start()
+
+    def submit(self, group, payload):
+        pending = _Pending(group, payload)
+        if len(payload) > self.max_batch:
+            self.direct += 1
+            self._execute(group, [pending])
+        else:
+            self.queue.put(pending)
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups = {}
+            for pending in batch:
+                groups.setdefault(pending.group, []).append(pending)
+            for group, items in groups.items():
+                self._execute(group, items)
+            self.batches += 1
+            self.requests += len(batch)
+
+    def _execute(self, group, items):
+        try:
+            texts = [text for pending in items for text in pending.payload]
+            if group[0] == "embed":
+                results = self.store.embed_texts(texts)
+            else:
+                _, kind, k, filters, nprobe, ef_search, rerank = group
+                results = self.store._search(
+                    kind,
+                    texts,
+                    k,
+                    filters=json.loads(filters),
+                    nprobe=nprobe,
+                    ef_search=ef_search,
+                    rerank=rerank,
+                )
+            start = 0
+            for pending in items:
+                pending.result = results[start:start + len(pending.payload)]
+                start += len(pending.payload)
+        except Exception as exc:
+            for pending in items:
+                pending.error = exc
+        finally:
+            for pending in items:
+                pending.done.set()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "direct": self.direct,
+        }
+
+def _search_group(kind, k, filters, nprobe, ef_search, rerank):
+    return ("search", kind, k, json.dumps(filters or {}, sort_keys=True, default=str), nprobe, ef_search, rerank)
+
+class VectorService:
+    """Owns one FaissStore and serves every worker over a local socket."""
+
+    def __init__(self, store, address=VECTOR_SERVICE_ADDRESS):
+        self.store = store
+        self.address = address
+        self.batcher = MicroBatcher(store, VECTOR_SERVICE_BATCH_WINDOW_MS, VECTOR_SERVICE_MAX_BATCH)
+
+    def serve_forever(self):
+        address, family = parse_address(self.address)
+        # any local user can reach a TCP port, and the default key is public
+        if family == "AF_INET" and VECTOR_SERVICE_AUTHKEY == DEFAULT_SECRET_KEY.encode("utf-8"):
+            raise RuntimeError("Set VECTOR_SERVICE_AUTHKEY (or SECRET_KEY) before serving on a TCP port")
+        if family == "AF_UNIX" and os.path.exists(address):
+            os.unlink(address)
+        with Listener(address, family=family, authkey=VECTOR_SERVICE_AUTHKEY) as listener:
+            print(f"Vector service listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as exc:
+                    print(f"Vector service rejected a connection: {exc}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(("ok", self._dispatch(method, args, kwargs)))
+                except Exception as exc:
+                    try:
+                        conn.send(("error", f"{type(exc).__name__}: {exc}"))
+                    except OSError:
+                        return
+
+    def _dispatch(self, method, args, kwargs):
+        if method == "embed_texts":
+            return self.batcher.submit(("embed",), list(args[0]))
+        if method == "search":
+            kind, queries = args
+            return self.batcher.submit(_search_group(kind, **kwargs), list(queries))
+        if method == "service_stats":
+            return self.batcher.stats()
+        if method not in DIRECT_METHODS:
+            raise ValueError(f"Unknown vector service method: {method}")
+        return getattr(self.store, method)(*args, **kwargs)
+
+class VectorServiceClient:
+    """
+    Thin stand-in for FaissStore that forwards calls to the vector service.
+    Each thread keeps its own connection and reconnects once on failure.
+    """
+
+    def __init__(self, address=VECTOR_SERVICE_ADDRESS):
+        self.address = address
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            address, family = parse_address(self.address)
+            conn = Client(address, family=family, authkey=VECTOR_SERVICE_AUTHKEY)
+            self.local.conn = conn
+        return conn
+
+    def _call(self, method, *args, **kwargs):
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((method, args, kwargs))
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                self.local.conn = None
+                if attempt:
+                    raise
+        if status == "error":
+            raise RuntimeError(f"vector service: {result}")
+        return result
+
+    def embed_texts(self, texts):
+        return self._call("embed_texts", list(texts))
+
+    def embed_queries(self, texts):
+        return self.embed_texts(texts)
+
+    def embed_query(self, text):
+        return self.embed_texts([text])
+
+    def _search(self, kind, queries, k, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._call(
+            "search", kind, list(queries), k=k, filters=filters, nprobe=nprobe, ef_search=ef_search, rerank=rerank
+        )
+
+    def search_questions(self, query, k=10, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._search("questions", [query], k, filters, nprobe, ef_search, rerank)[0]
+
+    def search_images(self, query, k=5, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._search("images", [query], k, filters, nprobe, ef_search, rerank)[0]
+
+    def search_questions_batch(self, queries, k=10, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._search("questions", queries, k, filters, nprobe, ef_search, rerank)
+
+    def search_images_batch(self, queries, k=5, filters=None, nprobe=None, ef_search=None, rerank=None):
+        return self._search("images", queries, k, filters, nprobe, ef_search, rerank)
+
+    def rebuild_from_db(self, session, Question, ImageAsset):
+        from rag.embeddings import collect_rebuild_rows
+
+        return self._call("rebuild_from_rows", collect_rebuild_rows(session, Question, ImageAsset))
+
+    def service_stats(self):
+        return self._call("service_stats")
+
+    def __getattr__(self, name):
+        if name in DIRECT_METHODS:
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+        raise AttributeError(name)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+print("LOADING warmup")
+
+from config import EMBEDDER_NOT_READY_MODE, EMBEDDER_WAIT_TIMEOUT
+from rag.embeddings import get_faiss_store
+
+class Warmup:
+    """
+    Loads the FAISS store and the embedding model in a background thread
+    so the first request after a deploy does not pay for them.
+    """
+
+    STEPS = ("index", "model")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.ready = threading.Event()
+        self.state = "idle"
+        self.steps = {step: {"done": False, "seconds": None} for step in self.STEPS}
+        self.model = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.started_at = time.time()
+            self.state = "loading"
+            self.thread = threading.Thread(target=self._run, name="embedder-warmup", daemon=True)
+            self.thread.start()
+
+    def _step(self, name, fn):
+        started = time.perf_counter()
+        result = fn()
+        self.steps[name] = {"done": True, "seconds": round(time.perf_counter() - started, 3)}
+        return result
+
+    def _run(self):
+        try:
+            store = self._step("index", get_faiss_store)
+            self.model = self._step("model", store.warm_up)
+            self.state = "ready"
+        except Exception as exc:
+            # requests fall back to loading lazily, as without a warm-up
+            self.error = str(exc)
+            self.state = "failed"
+            print(f"Warm-up failed: {exc}")
+        finally:
+            self.finished_at = time.time()
+            self.ready.set()
+
+    def status(self):
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            # without a warm-up thread the store loads lazily, as before
+            "ready": self.thread is None or self.ready.is_set(),
+            "state": self.state,
+            "steps": self.steps,
+            "model": self.model,
+            "error": self.error,
+            "elapsed_seconds": elapsed,
+            "not_ready_mode": EMBEDDER_NOT_READY_MODE,
+        }
+
+    def semantic_available(self):
+        """
+        Whether a request may use semantic search now. Without a running
+        warm-up the store loads lazily as before. While it runs, "wait"
+        blocks up to EMBEDDER_WAIT_TIMEOUT seconds and "sql" answers at once;
+        either way False means the caller should use SQL-only candidates.
+        """
+        if self.thread is None or self.ready.is_set():
+            return True
+        if EMBEDDER_NOT_READY_MODE == "wait" and self.ready.wait(EMBEDDER_WAIT_TIMEOUT):
+            return True
+        print("Embedder still warming up, using SQL-only candidates")
+        return False
+
+_warmup = Warmup()
+
+def start_warmup():
+    _warmup.start()
+
+def warmup_status():
+    return _warmup.status()
+
+def semantic_available():
+    # a store whose index no encoder can query is also answered by SQL
+    return _warmup.semantic_available() and get_faiss_store().semantic_search_ready()
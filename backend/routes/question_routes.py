@@ -1,4 +1,5 @@
 from datetime import datetime, timezone
+from functools import partial
 import os
 import time
 
@@ -15,8 +16,15 @@ from database.models import ImageAsset, Question, QuestionImageAssociation, Test
 from ingestion.ingest import ingest_single_pdf
 from ingestion.pdf_processor import serialize_image_to_base64
 from rag.embeddings import get_faiss_store
-from rag.generation import generate_enhanced_mcq
-from rag.retrieval import filter_questions_by_subject, retrieve_relevant_questions
+from rag.generation import generate_mcqs
+from rag.retrieval import (
+    filter_question_ids_by_subject,
+    question_dedupe_key,
+    rank_relevant_question_ids,
+    retrieval_cache_stats,
+    stream_questions,
+)
+from rag.warmup import warmup_status
 from rag.validation import image_relevance_score, is_valid_question_text, normalize_text
 
 question_bp = Blueprint("question_routes", __name__)
@@ -56,6 +64,12 @@ def health_check():
     }), 200
 
 
+@question_bp.route("/api/ready", methods=["GET"])
+def ready_check():
+    status = warmup_status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
 @question_bp.route("/api/upload-pdf", methods=["POST"])
 def upload_pdf():
     if "file" not in request.files:
@@ -70,7 +84,6 @@ def upload_pdf():
 
     try:
         result = ingest_single_pdf(db.session, pdf_path)
-        get_faiss_store().rebuild_from_db(db.session, Question, ImageAsset)
         return jsonify({
             "message": "PDF processed successfully",
             "questions_extracted": result["questions"],
@@ -100,6 +113,36 @@ def reingest():
     except Exception as e:
         return {"error": str(e)}, 500
 
+@question_bp.route("/api/admin/rebuild-index", methods=["POST"])
+def rebuild_index():
+    try:
+        store = get_faiss_store()
+        store.rebuild_from_db(db.session, Question, ImageAsset)
+        return {
+            "success": True,
+            "indexed": store.index_info(),
+        }, 200
+
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+@question_bp.route("/api/admin/index-report", methods=["GET"])
+def index_report():
+    try:
+        kind = request.args.get("kind", "questions")
+        if kind not in ("questions", "images"):
+            return {"error": "kind must be questions or images"}, 400
+        k = int(request.args.get("k", 10))
+        n_queries = int(request.args.get("queries", 200))
+        store = get_faiss_store()
+        report = store.storage_report(kind, k=k, n_queries=n_queries)
+        if request.args.get("verify", "false").lower() == "true":
+            report["snapshot_check"] = store.verify_snapshot()
+        return report, 200
+
+    except Exception as e:
+        return {"error": str(e)}, 500
+
 from database.models import Question, ImageAsset
 
 
@@ -107,7 +150,9 @@ from database.models import Question, ImageAsset
 def admin_stats():
     return {
         "questions": Question.query.count(),
-        "images": ImageAsset.query.count()
+        "images": ImageAsset.query.count(),
+        "embedding_cache": get_faiss_store().cache_stats(),
+        "retrieval_cache": retrieval_cache_stats(),
     }, 200
 
 
@@ -124,6 +169,9 @@ def generate_questions_api():
         user_id = payload.get("userId")
         use_recommendations = payload.get("useRecommendations", False)
         difficulty = payload.get("difficulty", "medium")
+        # 0 keeps the relevance ranking; towards 1 trades relevance for
+        # coverage of different sub-concepts (MMR over question embeddings)
+        diversity = min(max(float(payload.get("diversity", 0) or 0), 0.0), 1.0)
 
         weak_topics_weights = {}
         weak_topics = []
@@ -141,94 +189,103 @@ def generate_questions_api():
 
         # ---------------- Candidate Retrieval ----------------
 
-        retrieval_k = max(count * 8, 200)
+        # candidates are ranked on projected columns and streamed: full rows
+        # are loaded count at a time, and retrieval is only asked for a
+        # deeper list when the loop below rejects enough to run out. MMR
+        # needs a wider first pool to choose from.
+        first_k = max(count * (8 if diversity > 0 else 2), 20)
 
         if topic_filter:
-            candidates = retrieve_relevant_questions(
+            rank = partial(
+                rank_relevant_question_ids,
                 db.session,
                 topic_filter,
                 subject,
-                k=retrieval_k,
                 topic_filter=topic_filter,
                 weak_topics_weights=weak_topics_weights,
                 difficulty=difficulty,
+                diversity=diversity,
+                select=count,
             )
 
         elif weak_topics_weights:
-            candidates = retrieve_relevant_questions(
+            rank = partial(
+                rank_relevant_question_ids,
                 db.session,
-                " ".join(weak_topics[:3]) if weak_topics else subject,
+                weak_topics[:3] if weak_topics else subject,
                 subject,
-                k=retrieval_k,
                 weak_topics_weights=weak_topics_weights,
                 difficulty=difficulty,
+                diversity=diversity,
+                select=count,
             )
 
         else:
-            candidates = filter_questions_by_subject(
+            rank = partial(
+                filter_question_ids_by_subject,
                 db.session,
                 subject,
-                k=retrieval_k,
+                diversity=diversity,
+                select=count,
             )
 
+        candidates = stream_questions(db.session, rank, first_k, page_size=count)
+
         generated_questions = []
         seen_questions = set()
+        seen_clusters = set()
 
-        for question in candidates:
-
-            if len(generated_questions) >= count:
-                break
-
-            if not question:
-                continue
+        def conversions():
+            # runs in the request thread: rows come from db.session, and
+            # the MCQ workers only ever see the plain record
+            for question in candidates:
+                if not question:
+                    continue
 
-            if not is_valid_question_text(question.question_text):
-                continue
+                if not is_valid_question_text(question.question_text):
+                    continue
 
-            try:
-                # -------- For large tests, skip Groq completely --------
-                if count > 25:
-                    options = question.options or []
+                # near-duplicates of a question already in the test
+                if question_dedupe_key(question) in seen_clusters:
+                    continue
 
-                    if not isinstance(options, list):
-                        options = []
+                yield question, {
+                    "id": question.id,
+                    "text": question.question_text,
+                    "raw_text": question.raw_text,
+                    "question_text": question.question_text,
+                    "options": question.options or [],
+                    "answer_letter": question.answer_letter,
+                    "answer_text": question.answer_text,
+                    "solution": question.solution,
+                    "subject": question.subject,
+                    "page": question.page,
+                    "source_pdf": question.source_pdf,
+                    "topic": question.topic,
+                }
 
-                    if len(options) != 4:
-                        options = [
-                            "Option A",
-                            "Option B",
-                            "Option C",
-                            "Option D",
-                        ]
+        # MCQs are generated concurrently but accepted here in candidate
+        # order; leaving the loop cancels the calls not started yet
+        mcqs = generate_mcqs(
+            conversions(),
+            wanted=lambda: count - len(generated_questions),
+        )
 
-                    mcq = {
-                        "question": question.question_text,
-                        "options": options,
-                        "correct_answer": question.answer_letter or "A",
-                        "solution": question.solution or "",
-                    }
+        try:
+            for question, mcq in mcqs:
 
-                else:
-                    mcq = generate_enhanced_mcq({
-                        "id": question.id,
-                        "text": question.question_text,
-                        "raw_text": question.raw_text,
-                        "question_text": question.question_text,
-                        "options": question.options or [],
-                        "answer_letter": question.answer_letter,
-                        "answer_text": question.answer_text,
-                        "solution": question.solution,
-                        "subject": question.subject,
-                        "page": question.page,
-                        "source_pdf": question.source_pdf,
-                        "topic": question.topic,
-                    })
+                # an earlier candidate of the same cluster was accepted
+                # while this one was in flight
+                cluster = question_dedupe_key(question)
+                if cluster in seen_clusters:
+                    continue
 
+                try:
                     # fallback if Groq fails
                     if mcq is None:
                         options = question.options or []
 
-                        if len(options) != 4:
+                        if not isinstance(options, list) or len(options) != 4:
                             options = [
                                 "Option A",
                                 "Option B",
@@ -243,49 +300,53 @@ def generate_questions_api():
                             "solution": question.solution or "",
                         }
 
-                if not mcq:
-                    continue
+                    qtext = (mcq.get("question") or "").strip()
 
-                qtext = (mcq.get("question") or "").strip()
+                    if not qtext:
+                        continue
 
-                if not qtext:
-                    continue
+                    normalized = normalize_text(qtext).lower()
 
-                normalized = normalize_text(qtext).lower()
+                    if normalized in seen_questions:
+                        continue
 
-                if normalized in seen_questions:
-                    continue
+                    seen_questions.add(normalized)
+                    seen_clusters.add(cluster)
 
-                seen_questions.add(normalized)
-
-                question_obj = {
-                    "question": qtext,
-                    "options": mcq.get("options", []),
-                    "answer": mcq.get("correct_answer", "A"),
-                    "subject": question.subject or subject or "Unknown",
-                    "topic": question.topic or extract_topic_from_text(
-                        question.question_text
-                    ),
-                    "difficulty": question.difficulty or difficulty,
-                    "source_text": (
-                        question.raw_text or question.question_text
-                    )[:300],
-                    "page": question.page,
-                    "pdf_source": question.source_pdf,
-                    "solution": mcq.get("solution", ""),
-                }
+                    question_obj = {
+                        "question": qtext,
+                        "options": mcq.get("options", []),
+                        "answer": mcq.get("correct_answer", "A"),
+                        "subject": question.subject or subject or "Unknown",
+                        "topic": question.topic or extract_topic_from_text(
+                            question.question_text
+                        ),
+                        "difficulty": question.difficulty or difficulty,
+                        "source_text": (
+                            question.raw_text or question.question_text
+                        )[:300],
+                        "page": question.page,
+                        "pdf_source": question.source_pdf,
+                        "solution": mcq.get("solution", ""),
+                    }
 
-                generated_questions.append(question_obj)
+                    generated_questions.append(question_obj)
+
+                except Exception as e:
+                    print(f"Skipping question because of error: {e}")
+                    continue
 
-            except Exception as e:
-                print(f"Skipping question because of error: {e}")
-                continue
+                if len(generated_questions) >= count:
+                    break
+        finally:
+            mcqs.close()
 
         return jsonify({
             "questions": generated_questions,
             "subject": subject,
             "count": len(generated_questions),
             "difficulty": difficulty,
+            "diversity": diversity,
             "total_questions_in_db": Question.query.count(),
             "total_images_in_db": ImageAsset.query.count(),
             "weak_topics_used": weak_topics if use_recommendations else [],
@@ -0,0 +1,11 @@
+from config import VECTOR_SERVICE_ADDRESS
+from rag.embeddings import FaissStore
+from rag.vector_service import VectorService
+
+
+if __name__ == "__main__":
+    if not VECTOR_SERVICE_ADDRESS:
+        raise SystemExit("Set VECTOR_SERVICE_ADDRESS to a socket path or host:port")
+    store = FaissStore()
+    store.warm_up()
+    VectorService(store, VECTOR_SERVICE_ADDRESS).serve_forever()